@@ -0,0 +1,286 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework import permissions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api.conditional import not_modified, request_stamp, set_version_headers
+from api.filters import IngredientFilter
+from api.passwords import acheck_user_password, ahash_password
+from api.payloads import ingredient_payload, tag_payload
+from api.serializers import IngredientSerializer, UserSerializer
+from api.versions import INGREDIENTS_SCOPE, TAGS_SCOPE
+from api.views import (
+    change_password, IngredientViewSet, login_response, read_login,
+    read_password_change, RecipeViewSet, TagViewSet, UserViewSet
+)
+from api.views import login_user as login_view
+
+JSON_CONTENT_TYPE = 'application/json'
+
+recipe_list_view = RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+recipe_detail_view = RecipeViewSet.as_view({
+    'get': 'retrieve', 'patch': 'partial_update', 'delete': 'destroy'
+})
+tag_list_view = TagViewSet.as_view({'get': 'list'})
+tag_detail_view = TagViewSet.as_view({'get': 'retrieve'})
+ingredient_list_view = IngredientViewSet.as_view({'get': 'list'})
+ingredient_detail_view = IngredientViewSet.as_view({'get': 'retrieve'})
+user_list_view = UserViewSet.as_view({'get': 'list', 'post': 'create'})
+set_password_view = UserViewSet.as_view({'post': 'set_password'})
+
+
+def _call_view(view, request, **kwargs) -> HttpResponse:
+    '''
+    Выполняет DRF-представление целиком: запросы к БД, сериализацию
+    и рендеринг, чтобы обработчику не понадобился второй переход
+    в поток ради response.render().
+    '''
+    try:
+        response = view(request, **kwargs)
+        if not hasattr(response, 'render'):
+            return response
+        return _rendered(response)
+    finally:
+        close_old_connections()
+
+
+def _rendered(response) -> HttpResponse:
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+async def _read(view, request, **kwargs) -> HttpResponse:
+    '''
+    Чтение: один переход в пул потоков на запрос. Чтения не привязаны
+    к общему потоку синхронного кода и выполняются параллельно.
+    '''
+    return await sync_to_async(_call_view, thread_sensitive=False)(
+        view, request, **kwargs
+    )
+
+
+async def _write(view, request, **kwargs) -> HttpResponse:
+    '''Запись: как у синхронных представлений, в общем потоке.'''
+    return await sync_to_async(_call_view)(view, request, **kwargs)
+
+
+def _can_serve_from_memory(request) -> bool:
+    '''
+    Ответ из памяти не зависит от пользователя, но заголовок
+    Authorization проверяет DRF: неверный токен дает 401.
+    Браузеру DRF отдает HTML-страницу API.
+    '''
+    return (
+        request.method == 'GET'
+        and 'HTTP_AUTHORIZATION' not in request.META
+        and 'text/html' not in request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+def _payload_response(payload, request, stamp) -> HttpResponse:
+    response = payload.response(request)
+    set_version_headers(response, *stamp)
+    return response
+
+
+def _tag_list(request) -> HttpResponse:
+    '''
+    Список тегов из памяти. Версия данных читается из общего кэша,
+    то есть с сетевым обращением, поэтому вся обработка, включая
+    ответ 304, выполняется в потоке, за один переход из цикла событий.
+    '''
+    stamp = request_stamp(request, (TAGS_SCOPE,))
+    response = not_modified(request, *stamp)
+    if response is not None:
+        return response
+    return _payload_response(tag_payload, request, stamp)
+
+
+def _ingredient_list(request) -> HttpResponse:
+    '''Список и поиск ингредиентов из памяти, как _tag_list.'''
+    stamp = request_stamp(request, (INGREDIENTS_SCOPE,))
+    response = not_modified(request, *stamp)
+    if response is not None:
+        return response
+    ingredient_filter = IngredientFilter()
+    name = request.GET.get(ingredient_filter.search_param, '').strip()
+    if not name:
+        return _payload_response(ingredient_payload, request, stamp)
+    ingredients = ingredient_filter.search_index(name, request.GET)
+    response = HttpResponse(
+        JSONRenderer().render(
+            IngredientSerializer(ingredients, many=True).data
+        ),
+        content_type=JSON_CONTENT_TYPE
+    )
+    set_version_headers(response, *stamp)
+    return response
+
+
+class _PasswordView(APIView):
+    '''
+    Разбор запроса, аутентификация и ответы DRF для представлений
+    с хэшированием пароля, права - как у синхронных представлений.
+    '''
+    permission_classes = (permissions.AllowAny,)
+
+
+class _SetPasswordView(_PasswordView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+
+def _error(view, exc) -> HttpResponse:
+    return _rendered(
+        view.finalize_response(view.request, view.handle_exception(exc))
+    )
+
+
+def _step(view, func, *args):
+    '''Шаг обработки запроса: ответ DRF или ошибка сразу рендерятся.'''
+    try:
+        result = func(*args)
+    except Exception as exc:
+        return _error(view, exc)
+    if isinstance(result, Response):
+        return _rendered(view.finalize_response(view.request, result))
+    return result
+
+
+def _prepare(view, prepare):
+    view.initial(view.request)
+    return prepare(view.request)
+
+
+async def _password_view(view, request, prepare, hashing, finish):
+    '''
+    Запрос в три шага: prepare (проверка прав, разбор, чтение из БД)
+    и finish (запись в БД) - в общем потоке синхронного кода,
+    а хэширование пароля ожидается в цикле событий и этот поток
+    не занимает. Каждый шаг возвращает аргументы следующего.
+    '''
+    view.request = view.initialize_request(request)
+    view.args, view.kwargs = (), {}
+    view.headers = view.default_response_headers
+    state = await sync_to_async(_step)(view, _prepare, view, prepare)
+    if isinstance(state, HttpResponse):
+        return state
+    try:
+        state = await hashing(*state)
+    except Exception as exc:
+        return _error(view, exc)
+    return await sync_to_async(_step)(view, finish, *state)
+
+
+async def _check_login(user, password) -> tuple:
+    if user is not None and not await acheck_user_password(user, password):
+        user = None
+    return (user,)
+
+
+async def _hash_new_password(user, current_password, new_password) -> tuple:
+    password = None
+    if await acheck_user_password(user, current_password):
+        password = await ahash_password(new_password)
+    return user, password
+
+
+def _read_registration(request) -> tuple:
+    serializer = UserSerializer(
+        data=request.data, context={'request': request}
+    )
+    serializer.is_valid(raise_exception=True)
+    return (serializer,)
+
+
+async def _hash_registration(serializer) -> tuple:
+    password = serializer.validated_data.get('password')
+    return serializer, await ahash_password(password)
+
+
+def _register(serializer, encoded_password) -> Response:
+    serializer.save(encoded_password=encoded_password)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+async def login_user(request):
+    '''Получение токена: пароль проверяется без блокировки потока.'''
+    if request.method != 'POST':
+        return await _write(login_view, request)
+    return await _password_view(
+        _PasswordView(), request, read_login, _check_login, login_response
+    )
+
+
+async def user_list(request):
+    '''Список пользователей и регистрация.'''
+    if request.method != 'POST':
+        return await _read(user_list_view, request)
+    return await _password_view(
+        _PasswordView(), request,
+        _read_registration, _hash_registration, _register
+    )
+
+
+async def set_password(request):
+    '''Смена пароля: хэши считаются без блокировки потока.'''
+    if request.method != 'POST':
+        return await _write(set_password_view, request)
+    return await _password_view(
+        _SetPasswordView(), request,
+        read_password_change, _hash_new_password, change_password
+    )
+
+
+async def recipe_list(request):
+    '''Список рецептов и создание рецепта.'''
+    if request.method == 'GET':
+        return await _read(recipe_list_view, request)
+    return await _write(recipe_list_view, request)
+
+
+async def recipe_detail(request, pk):
+    '''Рецепт, его изменение и удаление.'''
+    if request.method == 'GET':
+        return await _read(recipe_detail_view, request, pk=pk)
+    return await _write(recipe_detail_view, request, pk=pk)
+
+
+async def tag_list(request):
+    '''Список тегов: из памяти, пока теги не менялись.'''
+    if not _can_serve_from_memory(request):
+        return await _read(tag_list_view, request)
+    return await _read(_tag_list, request)
+
+
+async def tag_detail(request, pk):
+    '''Тег.'''
+    return await _read(tag_detail_view, request, pk=pk)
+
+
+async def ingredient_list(request):
+    '''
+    Список и поиск ингредиентов: из памяти, пока актуальны
+    готовый список и индексы поиска, без DRF и сериализации запроса.
+    '''
+    if not _can_serve_from_memory(request):
+        return await _read(ingredient_list_view, request)
+    return await _read(_ingredient_list, request)
+
+
+async def ingredient_detail(request, pk):
+    '''Ингредиент.'''
+    return await _read(ingredient_detail_view, request, pk=pk)
+
+
+# Проверку CSRF для API выполняет DRF, как и у его представлений.
+for async_view in (
+    recipe_list, recipe_detail, tag_list, tag_detail,
+    ingredient_list, ingredient_detail, login_user, user_list, set_password,
+):
+    async_view.csrf_exempt = True
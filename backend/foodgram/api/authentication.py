@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+
+def _token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE]
+
+
+def _token_key(key: str) -> str:
+    return f'auth_token:{key}'
+
+
+def invalidate_tokens(*keys: str) -> None:
+    '''
+    Удаляет токены из кэша аутентификации сразу и еще раз после коммита:
+    до коммита параллельный запрос еще видит токен в БД и может вернуть
+    его в кэш.
+    '''
+    cache_keys = [_token_key(key) for key in keys]
+    if not cache_keys:
+        return
+    _token_cache().delete_many(cache_keys)
+    transaction.on_commit(lambda: _token_cache().delete_many(cache_keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    TokenAuthentication, который держит пару (пользователь, токен)
+    в кэше AUTH_TOKEN_CACHE и не обращается к БД на каждый запрос.
+    Записи удаляются сигналами при удалении токена и сохранении
+    пользователя (смена пароля, выход, деактивация).
+    '''
+    def authenticate_credentials(self, key):
+        cache = _token_cache()
+        cached = cache.get(_token_key(key))
+        if cached is not None:
+            return cached
+        credentials = super().authenticate_credentials(key)
+        cache.set(_token_key(key), credentials)
+        return credentials
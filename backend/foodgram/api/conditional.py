@@ -0,0 +1,70 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from api.versions import get_version_stamp, normalize_query, user_scope
+
+
+def set_version_headers(response, etag: str, last_modified: int) -> None:
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+
+
+def not_modified(request, etag: str, last_modified: int):
+    '''
+    Ответ 304 (или 412 для If-Match), если у клиента актуальная
+    версия, иначе None.
+    '''
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is not None:
+        set_version_headers(response, etag, last_modified)
+    return response
+
+
+def request_stamp(request, scopes, user_id=None, renderer_format='json'):
+    '''ETag и Last-Modified ответа на запрос по версиям данных scopes.'''
+    return get_version_stamp(
+        scopes, user_id, renderer_format,
+        request.path, normalize_query(request.GET)
+    )
+
+
+class ConditionalGetMixin:
+    '''
+    Условные GET-запросы для list и retrieve. ETag и Last-Modified
+    строятся по версиям данных из get_version_scopes() без запросов
+    к БД, так что при совпадении If-None-Match ответ 304 отдается
+    до выполнения запроса и сериализации.
+    Для авторизованных в версию входят их избранное, покупки и подписки.
+    '''
+    def get_version_scopes(self) -> list:
+        raise NotImplementedError
+
+    def get_version_stamp(self, request):
+        scopes = list(self.get_version_scopes())
+        user = request.user
+        if user.is_authenticated:
+            scopes.append(user_scope(user.pk))
+        return request_stamp(
+            request, scopes, user.pk, request.accepted_renderer.format
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_version_stamp(request)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                set_version_headers(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,16 +1,30 @@
 import django_filters
-from django.db.models import QuerySet
+from django.conf import settings
+from django.db.models import Case, IntegerField, QuerySet, Value, When
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 
+from api.indexes import (
+    ingredient_prefix_index, ingredient_trigram_index,
+    recipe_ingredient_index
+)
+from api.search import get_search_backend
 from recipes.models import Recipe, Tag
 
 
 class RecipeFilter(django_filters.FilterSet):
     '''
     Фильтры для viewset'а RecipeViewSet, для полей:
-    author, tags, is_in_shopping_cart, is_favorited.
+    author, tags, is_in_shopping_cart, is_favorited,
+    полнотекстовый поиск search по названию и описанию
+    и подбор по имеющимся ингредиентам have_ingredients=1,5,42
+    (с max_missing недостающими).
     '''
     author = django_filters.CharFilter(field_name='author_id')
+    search = django_filters.CharFilter(method='filter_search')
+    have_ingredients = django_filters.CharFilter(
+        method='filter_have_ingredients'
+    )
     tags = django_filters.ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
         field_name='tags__slug',
@@ -27,7 +41,82 @@ class RecipeFilter(django_filters.FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+            'search', 'have_ingredients'
+        )
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        '''
+        have_ingredients применяется последним: выдача по индексу
+        ограничена HAVE_INGREDIENTS_LIMIT, и лучшие рецепты выбираются
+        среди уже отфильтрованных остальными фильтрами.
+        '''
+        cleaned_data = self.form.cleaned_data
+        for name, value in cleaned_data.items():
+            if name != 'have_ingredients':
+                queryset = self.filters[name].filter(queryset, value)
+        return self.filters['have_ingredients'].filter(
+            queryset, cleaned_data.get('have_ingredients')
+        )
+
+    def filter_search(
+        self, queryset: QuerySet, name: str, value: str,
+    ) -> QuerySet:
+        '''Найденные рецепты по убыванию релевантности.'''
+        return get_search_backend().search(queryset, value)
+
+    def get_max_missing(self) -> int:
+        try:
+            max_missing = int(self.data.get('max_missing', 0))
+        except ValueError:
+            max_missing = -1
+        if max_missing < 0:
+            raise ValidationError(
+                {'max_missing': 'Должно быть целым неотрицательным числом.'}
+            )
+        return max_missing
+
+    def filter_have_ingredients(
+        self, queryset: QuerySet, name: str, value: str,
+    ) -> QuerySet:
+        '''
+        Рецепты, которые можно приготовить из ингредиентов value,
+        докупив не больше max_missing: по индексу в памяти,
+        по убыванию доли имеющихся ингредиентов. Если найдено больше
+        HAVE_INGREDIENTS_LIMIT, в ответе есть поле results_limit.
+        '''
+        try:
+            ingredient_ids = {
+                int(part) for part in value.split(',') if part.strip()
+            }
+        except ValueError:
+            raise ValidationError(
+                {name: 'Ожидаются id ингредиентов через запятую.'}
+            )
+        if len(ingredient_ids) > settings.HAVE_INGREDIENTS_MAX_IDS:
+            raise ValidationError({name: (
+                f'Не больше {settings.HAVE_INGREDIENTS_MAX_IDS} '
+                f'ингредиентов.'
+            )})
+        candidates = None
+        if queryset.query.has_filters():
+            candidates = set(queryset.order_by().values_list('pk', flat=True))
+        limit = settings.HAVE_INGREDIENTS_LIMIT
+        recipe_ids, found = recipe_ingredient_index.search(
+            ingredient_ids, self.get_max_missing(), limit, candidates
+        )
+        if found > limit:
+            self.request.results_limit = limit
+        if not recipe_ids:
+            return queryset.none()
+        return queryset.filter(pk__in=recipe_ids).annotate(
+            coverage_rank=Case(
+                *(When(pk=pk, then=Value(position))
+                  for position, pk in enumerate(recipe_ids)),
+                output_field=IntegerField()
+            )
+        ).order_by('coverage_rank')
 
     def filter_cart_and_favorite(
         self, queryset: QuerySet, name: str, value: int,
@@ -46,4 +135,40 @@ class RecipeFilter(django_filters.FilterSet):
 
 
 class IngredientFilter(SearchFilter):
+    '''
+    Поиск ингредиентов по началу названия, с ?fuzzy=1 по сходству
+    (с опечатками), ?limit= ограничивает выдачу нечеткого поиска.
+    Список отдается из индексов в памяти, без запроса к БД.
+    '''
     search_param = 'name'
+
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param, '').strip()
+        if not name or getattr(view, 'action', None) != 'list':
+            return super().filter_queryset(request, queryset, view)
+        return self.search_index(name, request.query_params)
+
+    @staticmethod
+    def is_fuzzy(params) -> bool:
+        return params.get('fuzzy') in ('1', 'true')
+
+    def get_index(self, params):
+        '''Индекс для запроса с параметрами params и аргументы поиска.'''
+        if self.is_fuzzy(params):
+            return ingredient_trigram_index, {
+                'limit': self.get_limit(params),
+                'threshold': settings.INGREDIENT_FUZZY_THRESHOLD,
+            }
+        return ingredient_prefix_index, {}
+
+    def search_index(self, name: str, params) -> list:
+        '''Поиск по индексу в памяти, params - параметры запроса.'''
+        index, options = self.get_index(params)
+        return index.search(name, **options)
+
+    def get_limit(self, params) -> int:
+        try:
+            limit = int(params['limit'])
+        except (KeyError, ValueError):
+            return settings.INGREDIENT_FUZZY_LIMIT
+        return max(1, min(limit, settings.INGREDIENT_FUZZY_MAX_LIMIT))
@@ -0,0 +1,136 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from api.response_cache import invalidate_recipe_responses
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Уменьшенные копии картинок рецептов строятся в пуле потоков:
+# Pillow отпускает GIL при декодировании, масштабировании и сжатии.
+_executor = None
+_executor_lock = threading.Lock()
+
+# Форматы, в которых оригинал пересохраняется без метаданных.
+SAVE_FORMATS = {'JPEG': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP', 'GIF': 'PNG'}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    return _executor
+
+
+def _encode(image: Image.Image, image_format: str, **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def strip_metadata(data: bytes):
+    '''
+    Пересохраняет картинку без EXIF и прочих метаданных,
+    с поворотом по EXIF-ориентации. Возвращает (байты, расширение).
+    '''
+    with Image.open(BytesIO(data)) as source:
+        image_format = SAVE_FORMATS.get(source.format, 'PNG')
+        image = ImageOps.exif_transpose(source)
+        if image_format == 'JPEG':
+            image = image.convert('RGB')
+            return _encode(image, 'JPEG', quality=90, optimize=True), 'jpg'
+        return _encode(image, image_format), image_format.lower()
+
+
+def make_variants(data: bytes) -> dict:
+    '''
+    Копии картинки фиксированных размеров RECIPE_IMAGE_SIZES в WebP:
+    {'small': байты, 'medium': байты}.
+    '''
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        return {
+            name: _encode(
+                ImageOps.fit(image, size, Image.LANCZOS), 'WEBP',
+                quality=settings.RECIPE_IMAGE_WEBP_QUALITY, method=6
+            )
+            for name, size in settings.RECIPE_IMAGE_SIZES.items()
+        }
+
+
+def generate_recipe_images(recipe_id: int) -> bool:
+    '''
+    Убирает метаданные из картинки рецепта и строит уменьшенные копии.
+    Возвращает False, если рецепта или файла уже нет.
+    '''
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return False
+    original = recipe.image
+    try:
+        with original.open('rb') as image_file:
+            data = image_file.read()
+    except FileNotFoundError:
+        return False
+    stripped, extension = strip_metadata(data)
+    storage = original.storage
+    fields = {
+        'image': storage.save(
+            original.field.generate_filename(recipe, f'image.{extension}'),
+            ContentFile(stripped)
+        )
+    }
+    for name, variant in make_variants(stripped).items():
+        field = Recipe._meta.get_field(f'image_{name}')
+        fields[field.name] = storage.save(
+            field.generate_filename(recipe, f'{name}.webp'),
+            ContentFile(variant)
+        )
+    # Картинку могли заменить, пока строились копии. Файлы общие
+    # для одинаковых картинок, лишние удаляет cleanup_recipe_images.
+    if Recipe.objects.filter(
+        pk=recipe_id, image=original.name
+    ).update(**fields):
+        invalidate_recipe_responses(recipe_id)
+    return True
+
+
+def _run_in_worker(recipe_id: int) -> None:
+    try:
+        generate_recipe_images(recipe_id)
+    finally:
+        close_old_connections()
+
+
+def _log_failure(recipe_id: int, future) -> None:
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.error(
+        'Не удалось обработать картинку рецепта %s.', recipe_id,
+        exc_info=future.exception()
+    )
+
+
+def _submit(recipe_id: int) -> None:
+    future = _get_executor().submit(_run_in_worker, recipe_id)
+    future.add_done_callback(lambda done: _log_failure(recipe_id, done))
+
+
+def schedule_recipe_images(recipe_id: int) -> None:
+    '''
+    Ставит обработку картинки рецепта в фоновый пул
+    после коммита транзакции, в которой сохранен рецепт.
+    '''
+    transaction.on_commit(lambda: _submit(recipe_id))
@@ -0,0 +1,370 @@
+import threading
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from recipes.models import Ingredient, RecipeIngredient
+
+
+def normalize(text: str) -> str:
+    '''Приводит строку к виду для поиска: без регистра, "ё" как "е".'''
+    return text.casefold().replace('ё', 'е')
+
+
+def trigrams(text: str) -> set:
+    '''Символьные триграммы слов строки, как в pg_trgm.'''
+    result = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _index_cache():
+    return caches[settings.VERSION_CACHE]
+
+
+class VersionedIndex:
+    '''
+    Индекс в памяти процесса, который лениво строится из БД.
+    Версии индекса хранятся в общем кэше versions: после invalidate()
+    каждый процесс перестроит свою копию при следующем обращении,
+    а после invalidate(created=True) только догрузит новые строки.
+    build() и append_new() собирают новые структуры, которые
+    подменяются вместе с версией одним присваиванием: чтение идет
+    без блокировки и всегда видит согласованный снимок.
+    '''
+    version_key = None
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        '''Новые данные индекса из БД.'''
+        raise NotImplementedError
+
+    def append_new(self, data):
+        '''Данные с догруженными новыми строками, data не меняется.'''
+        return self.build()
+
+    def _versions(self) -> tuple:
+        append_key = f'{self.version_key}:append'
+        versions = _index_cache().get_many([self.version_key, append_key])
+        return versions.get(self.version_key), versions.get(append_key)
+
+    def fresh_data(self):
+        '''Данные, если копия актуальна, иначе None; без запросов к БД.'''
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == self._versions():
+            return snapshot[1]
+        return None
+
+    def get_data(self):
+        '''Актуальные данные, при необходимости перестроенные из БД.'''
+        data = self.fresh_data()
+        if data is not None:
+            return data
+        with self._lock:
+            # Версии читаются до загрузки из БД: изменение во время
+            # загрузки даст новую версию и следующую перестройку.
+            versions = self._versions()
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot[0] == versions:
+                return snapshot[1]
+            if snapshot is None or snapshot[0][0] != versions[0]:
+                data = self.build()
+            else:
+                data = self.append_new(snapshot[1])
+            self._snapshot = (versions, data)
+        return data
+
+    @classmethod
+    def _set_version(cls, key: str) -> None:
+        _index_cache().set(key, uuid.uuid4().hex, None)
+
+    @classmethod
+    def invalidate(cls, created: bool = False) -> None:
+        '''
+        Новая версия индекса после коммита текущей транзакции,
+        чтобы перестройка не прочитала незакоммиченные строки.
+        '''
+        key = f'{cls.version_key}:append' if created else cls.version_key
+        transaction.on_commit(lambda: cls._set_version(key))
+
+
+class IngredientIndex(VersionedIndex):
+    '''Базовый индекс по таблице ингредиентов.'''
+    version_key = 'index:ingredients:version'
+
+    @staticmethod
+    def load(after_pk: int = 0) -> list:
+        '''Строки (id, название, единица) с id больше after_pk.'''
+        return list(
+            Ingredient.objects.filter(pk__gt=after_pk).order_by(
+                'pk'
+            ).values_list('id', 'name', 'measurement_unit')
+        )
+
+    def add(self, data, rows: list):
+        '''Новые данные: data (None - пустой индекс) и строки rows.'''
+        raise NotImplementedError
+
+    def build(self):
+        return self.add(None, self.load())
+
+    def append_new(self, data):
+        return self.add(data, self.load(data.max_pk))
+
+    @staticmethod
+    def max_pk(data, rows: list) -> int:
+        max_pk = data.max_pk if data is not None else 0
+        return max(max_pk, rows[-1][0]) if rows else max_pk
+
+
+PrefixData = namedtuple('PrefixData', 'max_pk keys rows')
+
+
+class IngredientPrefixIndex(IngredientIndex):
+    '''Отсортированный индекс названий ингредиентов для поиска по началу.'''
+    def add(self, data, rows: list) -> PrefixData:
+        index_rows = sorted(
+            (data.rows if data is not None else []) + [
+                (normalize(name), pk, name, unit) for pk, name, unit in rows
+            ]
+        )
+        return PrefixData(
+            self.max_pk(data, rows), [row[0] for row in index_rows],
+            index_rows
+        )
+
+    def search(self, prefix: str, data: PrefixData = None) -> list:
+        '''
+        Ингредиенты, название которых начинается с prefix.
+        Сначала точное совпадение, затем более короткие названия.
+        '''
+        if data is None:
+            data = self.get_data()
+        key = normalize(prefix)
+        start = bisect_left(data.keys, key)
+        end = bisect_left(data.keys, key + '\uffff')
+        rows = data.rows[start:end]
+        rows.sort(key=lambda row: (len(row[0]), row[0]))
+        return [
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for _, pk, name, unit in rows
+        ]
+
+
+TrigramData = namedtuple('TrigramData', 'max_pk rows postings')
+
+
+class IngredientTrigramIndex(IngredientIndex):
+    '''
+    Инвертированный индекс триграмм названий ингредиентов
+    для поиска с опечатками.
+    '''
+    def add(self, data, rows: list) -> TrigramData:
+        if data is None:
+            index_rows, postings = [], {}
+        else:
+            index_rows, postings = list(data.rows), dict(data.postings)
+        added = defaultdict(list)
+        for pk, name, unit in rows:
+            row_trigrams = trigrams(name)
+            added_position = len(index_rows)
+            index_rows.append((pk, name, unit, len(row_trigrams)))
+            for trigram in row_trigrams:
+                added[trigram].append(added_position)
+        # Списки позиций старого снимка не меняются: их читают запросы.
+        for trigram, positions in added.items():
+            postings[trigram] = postings.get(trigram, []) + positions
+        return TrigramData(self.max_pk(data, rows), index_rows, postings)
+
+    def search(
+        self, query: str, limit: int, threshold: float,
+        data: TrigramData = None
+    ) -> list:
+        '''
+        Ингредиенты, похожие на query, по убыванию сходства
+        (коэффициент Жаккара по триграммам), не больше limit.
+        '''
+        if data is None:
+            data = self.get_data()
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(data.postings.get(trigram, ()))
+        scored = []
+        for position, count in shared.items():
+            pk, name, unit, size = data.rows[position]
+            score = count / (len(query_trigrams) + size - count)
+            if score >= threshold:
+                scored.append((-score, len(name), name, pk, unit))
+        scored.sort()
+        return [
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for _, _, name, pk, unit in scored[:limit]
+        ]
+
+
+class RecipeIngredientPostings:
+    '''
+    Данные RecipeIngredientIndex: списки рецептов по ингредиентам,
+    ингредиенты и их число по рецептам. Изменения из журнала
+    применяются на месте, под блокировкой lock.
+    '''
+    def __init__(self, sequence: int):
+        self.sequence = sequence
+        self.postings = defaultdict(lambda: array('I'))
+        self.recipes = {}
+        # Число ингредиентов по id рецепта в плоском массиве:
+        # быстрее словаря при подсчете недостающих.
+        self.sizes = array('H')
+        self.lock = threading.Lock()
+
+    def set_recipe(self, recipe_id: int, ingredients: tuple) -> None:
+        if recipe_id >= len(self.sizes):
+            self.sizes.extend([0] * (recipe_id + 1 - len(self.sizes)))
+        self.sizes[recipe_id] = len(ingredients)
+        if ingredients:
+            self.recipes[recipe_id] = ingredients
+        else:
+            self.recipes.pop(recipe_id, None)
+
+    def update(self, recipe_ids) -> None:
+        '''Перечитывает ингредиенты рецептов recipe_ids из БД.'''
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        for recipe_id in recipe_ids:
+            old = set(self.recipes.get(recipe_id, ()))
+            new = current.get(recipe_id, set())
+            for ingredient_id in old - new:
+                postings = self.postings[ingredient_id]
+                del postings[bisect_left(postings, recipe_id)]
+            for ingredient_id in new - old:
+                insort(self.postings[ingredient_id], recipe_id)
+            self.set_recipe(recipe_id, tuple(new))
+
+
+class RecipeIngredientIndex(VersionedIndex):
+    '''
+    Инвертированный индекс ингредиент -> отсортированный массив id
+    рецептов (array('I')) для поиска рецептов по имеющимся продуктам.
+    Изменения рецептов попадают в журнал в кэше versions:
+    record_changes() кладет id рецептов под очередным номером,
+    каждый процесс догружает только их. Если журнал вытеснен
+    или номер занят параллельной записью - полная перестройка.
+    '''
+    version_key = 'index:recipe_ingredients:version'
+    sequence_key = 'index:recipe_ingredients:sequence'
+    change_timeout = 60 * 60 * 24
+
+    def build(self) -> RecipeIngredientPostings:
+        data = RecipeIngredientPostings(
+            _index_cache().get(self.sequence_key, 0)
+        )
+        rows = RecipeIngredient.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id').iterator(
+            chunk_size=10000
+        )
+        recipes = defaultdict(list)
+        for ingredient_id, recipe_id in rows:
+            data.postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        for recipe_id, ingredients in recipes.items():
+            data.set_recipe(recipe_id, tuple(ingredients))
+        return data
+
+    def get_data(self) -> RecipeIngredientPostings:
+        data = super().get_data()
+        cache = _index_cache()
+        sequence = cache.get(self.sequence_key, 0)
+        if sequence == data.sequence:
+            return data
+        with data.lock:
+            if sequence > data.sequence:
+                keys = [
+                    f'{self.sequence_key}:{number}'
+                    for number in range(data.sequence + 1, sequence + 1)
+                ]
+                changes = cache.get_many(keys)
+                if len(changes) == len(keys):
+                    data.update(set().union(*changes.values()))
+                    data.sequence = sequence
+                    return data
+        # Журнал вытеснен или начат заново: полная перестройка.
+        with self._lock:
+            if self._snapshot[1] is not data:
+                # Уже перестроен в другом потоке.
+                return self._snapshot[1]
+            versions = self._versions()
+            data = self.build()
+            self._snapshot = (versions, data)
+        return data
+
+    @classmethod
+    def record_changes(cls, *recipe_ids) -> None:
+        '''Отмечает изменение ингредиентов рецептов после коммита.'''
+        def record():
+            cache = _index_cache()
+            if cache.add(cls.sequence_key, 0, None):
+                # Номера журнала начались заново.
+                cls._set_version(cls.version_key)
+            try:
+                sequence = cache.incr(cls.sequence_key)
+            except ValueError:
+                cls._set_version(cls.version_key)
+                return
+            # Номер может оказаться занят, если счетчик был вытеснен
+            # и начат заново: старую запись не затирать, а перестроить.
+            if not cache.add(
+                f'{cls.sequence_key}:{sequence}', set(recipe_ids),
+                cls.change_timeout
+            ):
+                cls._set_version(cls.version_key)
+        transaction.on_commit(record)
+
+    def search(
+        self, ingredient_ids, max_missing: int, limit: int, candidates=None
+    ) -> tuple:
+        '''
+        id рецептов, в которых есть хотя бы один из ingredient_ids
+        и не хватает не больше max_missing ингредиентов: по убыванию
+        доли имеющихся, затем по числу недостающих, не больше limit.
+        candidates - множество id, среди которых искать (None - все).
+        Возвращает (id рецептов, число найденных до ограничения).
+        '''
+        data = self.get_data()
+        with data.lock:
+            hits = Counter()
+            for ingredient_id in set(ingredient_ids):
+                postings = data.postings.get(ingredient_id)
+                if postings:
+                    hits.update(postings)
+            sizes = data.sizes
+            found = []
+            for recipe_id, count in hits.items():
+                missing = sizes[recipe_id] - count
+                if missing <= max_missing and (
+                    candidates is None or recipe_id in candidates
+                ):
+                    found.append(
+                        (-count / (count + missing), missing, -recipe_id)
+                    )
+        found.sort()
+        return [-recipe_id for _, _, recipe_id in found[:limit]], len(found)
+
+
+ingredient_prefix_index = IngredientPrefixIndex()
+ingredient_trigram_index = IngredientTrigramIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from api.images import generate_recipe_images
+from recipes.models import Recipe
+
+
+def _process(recipe_id: int):
+    try:
+        return generate_recipe_images(recipe_id), None
+    except Exception as error:
+        return False, error
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит уменьшенные копии картинок (WebP) и убирает метаданные '
+        'у рецептов, для которых копий еще нет.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересобрать копии у всех рецептов.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.RECIPE_IMAGE_WORKERS,
+            help='Число потоков обработки.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(Q(image_small='') | Q(image_medium=''))
+        recipe_ids = list(recipes.order_by('pk').values_list('pk', flat=True))
+        done = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for recipe_id, (processed, error) in zip(
+                recipe_ids, executor.map(_process, recipe_ids)
+            ):
+                if error is not None:
+                    self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                elif not processed:
+                    self.stderr.write(f'Рецепт {recipe_id}: файла нет.')
+                else:
+                    done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {done} из {len(recipe_ids)}.'
+        ))
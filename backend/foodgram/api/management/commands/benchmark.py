@@ -0,0 +1,559 @@
+import asyncio
+import importlib
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlencode
+
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import clear_url_caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication
+from api.indexes import ingredient_prefix_index
+
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredient, RecipeShoppingList, ShoppingList,
+    Tag
+)
+
+User = get_user_model()
+
+HOST = 'testserver'
+
+# Кэши замеров живут в памяти процесса: общий memcached не трогается.
+BENCHMARK_CACHES = {
+    name: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'benchmark-{name}',
+    }
+    for name in settings.CACHES
+}
+
+
+def percentile(values: list, share: float) -> float:
+    '''Значение, которого не превышает доля share замеров.'''
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def use_async_views(enabled: bool) -> None:
+    '''
+    Маршруты API как под ASGI (асинхронные представления) или WSGI:
+    модули URL перечитываются с новым значением ASYNC_READ_VIEWS.
+    '''
+    with override_settings(ASYNC_READ_VIEWS=enabled):
+        importlib.reload(importlib.import_module('api.urls'))
+        importlib.reload(importlib.import_module('foodgram.urls'))
+    clear_url_caches()
+
+
+def wsgi_environ(path: str, query: str = '', headers=()) -> dict:
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': HOST,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        environ[f'HTTP_{name.upper().replace("-", "_")}'] = value
+    return environ
+
+
+def asgi_scope(path: str, query: str = '', headers=()) -> dict:
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode())] + [
+            (name.lower().encode(), value.encode())
+            for name, value in headers
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+
+
+class WSGIServer:
+    '''Обработчик WSGI в пуле из threads потоков, как у gunicorn --threads.'''
+    def __init__(self, threads: int):
+        self.handler = WSGIHandler()
+        self.threads = threads
+
+    def start(self, loop):
+        self.executor = ThreadPoolExecutor(self.threads)
+
+    def stop(self):
+        self.executor.shutdown()
+
+    def call(self, path: str, query: str, headers) -> tuple:
+        statuses = []
+        response = self.handler(
+            wsgi_environ(path, query, headers),
+            lambda status, headers, exc_info=None: statuses.append(status)
+        )
+        try:
+            body = b''.join(response)
+        finally:
+            response.close()
+        return int(statuses[0].split()[0]), body
+
+    async def request(self, path: str, query: str = '', headers=()) -> tuple:
+        '''Статус и тело ответа на GET-запрос.'''
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.call, path, query, headers
+        )
+
+
+class ASGIServer:
+    '''
+    Обработчик ASGI в цикле событий, как у uvicorn. Пул потоков
+    для sync_to_async(thread_sensitive=False) - threads потоков.
+    '''
+    def __init__(self, threads: int):
+        self.handler = ASGIHandler()
+        self.threads = threads
+
+    def start(self, loop):
+        # Пул по умолчанию закрывает asyncio.run() при выходе.
+        loop.set_default_executor(ThreadPoolExecutor(self.threads))
+
+    def stop(self):
+        pass
+
+    async def request(self, path: str, query: str = '', headers=()) -> tuple:
+        '''Статус и тело ответа на GET-запрос.'''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.handler(asgi_scope(path, query, headers), receive, send)
+        return messages[0]['status'], b''.join(
+            message.get('body', b'') for message in messages[1:]
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочные замеры API во временной тестовой БД. '
+        'handlers - WSGI против ASGI при множестве одновременных '
+        'соединений: запросы в секунду, задержка p50 и p99. '
+        'pdf - задержка чтений API, пока идут скачивания PDF-файлов '
+        'списка покупок: в потоке запроса и в фоне (?async=1). '
+        'cart - запросы к БД и время выгрузки списков покупок '
+        'растущего размера. ingredients - поиск ингредиентов '
+        'по началу названия: индекс в памяти против запроса к БД. '
+        'auth - аутентификация по токену с кэшем и без него.'
+    )
+
+    def add_arguments(self, parser):
+        scenarios = parser.add_subparsers(dest='scenario', required=True)
+        handlers = scenarios.add_parser(
+            'handlers', help='WSGI против ASGI на чтениях API.'
+        )
+        handlers.add_argument(
+            '--connections', type=int, default=500,
+            help='Одновременных соединений (клиентов).'
+        )
+        handlers.add_argument(
+            '--requests', type=int, default=2000,
+            help='Запросов на каждый адрес и обработчик.'
+        )
+        handlers.add_argument(
+            '--threads', type=int, default=32,
+            help='Потоков сервера (WSGI) и пула sync_to_async (ASGI).'
+        )
+        handlers.add_argument('--recipes', type=int, default=500)
+        pdf = scenarios.add_parser(
+            'pdf', help='Чтения API во время генерации PDF-файлов.'
+        )
+        pdf.add_argument(
+            '--connections', type=int, default=50,
+            help='Одновременных клиентов, читающих список рецептов.'
+        )
+        pdf.add_argument(
+            '--requests', type=int, default=2000,
+            help='Запросов к списку рецептов на каждый режим.'
+        )
+        pdf.add_argument(
+            '--renders', type=int, default=4,
+            help='Клиентов, одновременно скачивающих PDF-файл.'
+        )
+        pdf.add_argument(
+            '--threads', type=int, default=32, help='Потоков сервера (WSGI).'
+        )
+        pdf.add_argument('--recipes', type=int, default=500)
+        pdf.add_argument(
+            '--cart', type=int, default=100,
+            help='Рецептов в списке покупок каждого клиента.'
+        )
+        cart = scenarios.add_parser(
+            'cart', help='Выгрузка списков покупок растущего размера.'
+        )
+        cart.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 10, 100, 500],
+            help='Рецептов в списке покупок.'
+        )
+        cart.add_argument(
+            '--requests', type=int, default=20,
+            help='Выгрузок на каждый размер и формат.'
+        )
+        ingredients = scenarios.add_parser(
+            'ingredients', help='Поиск по началу названия: индекс и БД.'
+        )
+        ingredients.add_argument('--ingredients', type=int, default=20000)
+        ingredients.add_argument(
+            '--requests', type=int, default=200,
+            help='Поисков на каждое начало названия и способ.'
+        )
+        auth = scenarios.add_parser(
+            'auth', help='Аутентификация по токену с кэшем и без него.'
+        )
+        auth.add_argument(
+            '--requests', type=int, default=2000,
+            help='Проверок токена или запросов на каждый способ.'
+        )
+
+    def handle(self, *args, scenario, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # DEBUG копит все SQL-запросы в памяти и искажает замеры.
+            with override_settings(
+                DEBUG=False, ALLOWED_HOSTS=[HOST], CACHES=BENCHMARK_CACHES
+            ):
+                getattr(self, f'handle_{scenario}')(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def report(self, title: str, latencies: list, elapsed: float, errors=0):
+        self.stdout.write(
+            f'{title:<48} {len(latencies) / elapsed:>8.0f} rps  '
+            f'p50 {percentile(latencies, 0.5) * 1000:>8.1f} ms  '
+            f'p99 {percentile(latencies, 0.99) * 1000:>8.1f} ms'
+            + (f'  ошибок {errors}' if errors else '')
+        )
+
+    @staticmethod
+    async def load(server, path, query, connections, requests) -> tuple:
+        '''
+        connections клиентов шлют запросы друг за другом, всего
+        requests. Возвращает задержки, время и число ответов не 200.
+        '''
+        latencies, errors = [], 0
+        remaining = iter(range(requests))
+
+        async def client():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                status, _ = await server.request(path, query)
+                latencies.append(time.perf_counter() - started)
+                errors += status != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(connections)))
+        return latencies, time.perf_counter() - started, errors
+
+    def handle_handlers(
+        self, connections, requests, threads, recipes, **options
+    ):
+        recipe = self.seed(recipes)[-1]
+        targets = (
+            ('/api/tags/', ''),
+            ('/api/ingredients/', urlencode({'name': 'Продукт 123'})),
+            ('/api/recipes/', 'limit=6'),
+            (f'/api/recipes/{recipe.pk}/', ''),
+        )
+        self.stdout.write(
+            f'{connections} соединений, {threads} потоков, '
+            f'{requests} запросов на адрес'
+        )
+        for name, server_class, async_views in (
+            ('WSGI', WSGIServer, False), ('ASGI', ASGIServer, True)
+        ):
+            use_async_views(async_views)
+            asyncio.run(self.measure(
+                name, server_class(threads), targets, connections, requests
+            ))
+        use_async_views(False)
+
+    async def measure(self, name, server, targets, connections, requests):
+        server.start(asyncio.get_running_loop())
+        try:
+            for path, query in targets:
+                # Прогрев: кэши, индексы и соединения с БД.
+                await self.load(
+                    server, path, query, server.threads, server.threads
+                )
+                self.report(
+                    f'{name} {path}?{unquote(query)}',
+                    *await self.load(
+                        server, path, query, connections, requests
+                    )
+                )
+        finally:
+            server.stop()
+
+    def handle_pdf(
+        self, connections, requests, renders, threads, recipes, cart,
+        **options
+    ):
+        cart_recipes = self.seed(recipes)[:cart]
+        headers = [self.shopper(i, cart_recipes) for i in range(renders)]
+        self.stdout.write(
+            f'{connections} клиентов /api/recipes/, {renders} скачивают '
+            f'PDF ({cart} рецептов), {threads} потоков WSGI, '
+            f'{settings.SHOPPING_LIST_PDF_WORKERS} процессов PDF'
+        )
+        use_async_views(False)
+        asyncio.run(self.measure_pdf(
+            WSGIServer(threads), headers, connections, requests
+        ))
+
+    async def measure_pdf(self, server, headers, connections, requests):
+        server.start(asyncio.get_running_loop())
+        path, query = '/api/recipes/', 'limit=6'
+        try:
+            await self.load(server, path, query, server.threads, requests)
+            for title, renders, background in (
+                ('без скачиваний PDF', 0, False),
+                ('PDF в потоке запроса', len(headers), False),
+                ('PDF в пуле процессов (?async=1)', len(headers), True),
+            ):
+                stop = asyncio.Event()
+                downloads = [
+                    asyncio.create_task(
+                        self.download(server, header, stop, background)
+                    )
+                    for header in headers[:renders]
+                ]
+                result = await self.load(
+                    server, path, query, connections, requests
+                )
+                stop.set()
+                rendered = sum(await asyncio.gather(*downloads))
+                self.report(f'{title}, построено {rendered}', *result)
+        finally:
+            server.stop()
+
+    @staticmethod
+    async def download(server, headers, stop, background: bool) -> int:
+        '''
+        Скачивает PDF-файл списка покупок, пока не выставлен stop.
+        Кэш PDF-файлов очищается перед каждым скачиванием, чтобы файл
+        строился заново. Возвращает число полученных файлов.
+        '''
+        path = '/api/recipes/download_shopping_cart/'
+        rendered = 0
+        while not stop.is_set():
+            caches[settings.SHOPPING_LIST_PDF_CACHE].clear()
+            if not background:
+                status, _ = await server.request(path, '', headers)
+                rendered += status == 200
+                continue
+            status, body = await server.request(path, 'async=1', headers)
+            if status != 202:
+                # Очередь фоновой генерации заполнена.
+                await asyncio.sleep(0.05)
+                continue
+            job_path = f'{path}jobs/{json.loads(body)["id"]}/'
+            while True:
+                await asyncio.sleep(0.05)
+                status, body = await server.request(job_path, '', headers)
+                if body.startswith(b'%PDF'):
+                    rendered += 1
+                    break
+                if status != 200 or json.loads(body)['status'] != 'pending':
+                    break
+        return rendered
+
+    def handle_cart(self, sizes, requests, **options):
+        '''
+        Выгрузки идут друг за другом в текущем потоке: считаются запросы
+        к БД одной выгрузки. PDF-файл строится заново на каждой.
+        '''
+        recipes = self.seed(max(sizes))
+        server = WSGIServer(threads=1)
+        path = '/api/recipes/download_shopping_cart/'
+        for size in sizes:
+            headers = self.shopper(size, recipes[:size])
+            for export_format in ('csv', 'json', 'pdf'):
+                query = urlencode({'format': export_format})
+                latencies = []
+                for _ in range(requests):
+                    caches[settings.SHOPPING_LIST_PDF_CACHE].clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        status, _ = server.call(path, query, headers)
+                        latencies.append(time.perf_counter() - started)
+                self.report(
+                    f'{size:>4} рецептов, {export_format}, '
+                    f'запросов к БД {len(queries)}',
+                    latencies, sum(latencies), int(status != 200)
+                )
+
+    def handle_ingredients(self, ingredients, requests, **options):
+        '''
+        Индекс (IngredientFilter) против прежнего пути SearchFilter
+        с ^name: name__istartswith в БД. Индекс заранее прогрет.
+        '''
+        words = (
+            'Молоко', 'Мука', 'Масло', 'Сахар', 'Соль', 'Сыр',
+            'Капуста', 'Картофель', 'Лук', 'Чеснок'
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f'{words[i % len(words)]} {i}', measurement_unit='г'
+            )
+            for i in range(ingredients)
+        )
+        ingredient_prefix_index.get_data()
+        for prefix in ('М', 'Мо', 'Сыр', 'Капуста 1', 'Лук 12', 'Хлеб'):
+            for title, search in (
+                ('индекс', ingredient_prefix_index.search),
+                ('БД', lambda prefix: list(
+                    Ingredient.objects.filter(name__istartswith=prefix)
+                )),
+            ):
+                latencies = []
+                for _ in range(requests):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        found = search(prefix)
+                        latencies.append(time.perf_counter() - started)
+                self.report(
+                    f'{title} {prefix!r}: найдено {len(found)}, '
+                    f'запросов к БД {len(queries)}',
+                    latencies, sum(latencies)
+                )
+
+    def handle_auth(self, requests, **options):
+        '''
+        Проверка токена отдельно (TokenAuthentication из DRF против
+        CachedTokenAuthentication) и весь запрос /api/users/me/ с кэшем
+        токенов и с кэшем, очищаемым перед каждым запросом.
+        '''
+        headers = self.shopper(0, [])
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION=dict(headers)['Authorization']
+        )
+        token_cache = caches[settings.AUTH_TOKEN_CACHE]
+        server = WSGIServer(threads=1)
+        for title, run, cached in (
+            ('TokenAuthentication',
+             lambda: TokenAuthentication().authenticate(request), False),
+            ('CachedTokenAuthentication',
+             lambda: CachedTokenAuthentication().authenticate(request), True),
+            ('/api/users/me/ без кэша',
+             lambda: server.call('/api/users/me/', '', headers), False),
+            ('/api/users/me/ с кэшем',
+             lambda: server.call('/api/users/me/', '', headers), True),
+        ):
+            run()
+            latencies = []
+            for _ in range(requests):
+                if not cached:
+                    token_cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    run()
+                    latencies.append(time.perf_counter() - started)
+            self.report(
+                f'{title}, запросов к БД {len(queries)}',
+                latencies, sum(latencies)
+            )
+
+    @staticmethod
+    def shopper(number: int, recipes: list) -> tuple:
+        '''Пользователь со списком покупок recipes, заголовки его запросов.'''
+        user = User.objects.create(
+            username=f'shopper{number}', email=f'shopper{number}@example.com',
+            first_name='Имя', last_name='Фамилия'
+        )
+        shopping_list = ShoppingList.objects.create(owner=user)
+        RecipeShoppingList.objects.bulk_create(
+            RecipeShoppingList(shopping_list=shopping_list, recipe=recipe)
+            for recipe in recipes
+        )
+        token = Token.objects.create(user=user)
+        return (('Authorization', f'Token {token.key}'),)
+
+    @staticmethod
+    def seed(recipes_count: int) -> list:
+        User.objects.bulk_create(
+            User(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(20)
+        )
+        authors = list(User.objects.order_by('pk'))
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color=f'#ABCDE{i}', slug=f'tag{i}'
+            )
+            for i in range(5)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i}', measurement_unit='г')
+            for i in range(2000)
+        )
+        ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'Рецепт {i}', text='Текст', cooking_time=10,
+                image='recipes/images/benchmark.png',
+                author=authors[i % len(authors)]
+            )
+            for i in range(recipes_count)
+        )
+        recipes = list(Recipe.objects.order_by('pk'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tags[i % len(tags)])
+            for i, recipe in enumerate(recipes)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_ids[(i * 7 + j) % 2000],
+                amount=j + 1
+            )
+            for i, recipe in enumerate(recipes) for j in range(8)
+        )
+        return recipes
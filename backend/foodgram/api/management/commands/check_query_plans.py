@@ -0,0 +1,172 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.services import get_shopping_list_ingredients
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient,
+    RecipeShoppingList, ShoppingList, Tag
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+# Справочники, которые допустимо читать целиком.
+FULL_SCAN_ALLOWED = {Tag._meta.db_table}
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет БД тестовыми данными (с откатом), выполняет '
+        'EXPLAIN QUERY PLAN для основных запросов представлений '
+        'и завершается ошибкой, если запрос читает таблицу целиком.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=2000,
+            help='Сколько рецептов создать для проверки.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Проверка поддерживается только для SQLite.')
+        with transaction.atomic():
+            user, author, shopping_list = self.seed(options['recipes'])
+            failures = []
+            for title, queryset in self.queries(user, author, shopping_list):
+                plan = self.explain(queryset)
+                scans = [
+                    detail for detail in plan
+                    if self.is_full_scan(detail)
+                ]
+                status = 'FAIL' if scans else 'ok'
+                self.stdout.write(f'[{status}] {title}')
+                for detail in plan:
+                    self.stdout.write(f'    {detail}')
+                if scans:
+                    failures.append(title)
+            transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                'Полный просмотр таблиц в запросах: ' + ', '.join(failures)
+            )
+        self.stdout.write(
+            self.style.SUCCESS('Все запросы используют индексы.')
+        )
+
+    @staticmethod
+    def explain(queryset) -> list:
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @staticmethod
+    def is_full_scan(detail: str) -> bool:
+        '''Строка плана "SCAN <таблица>" без индекса.'''
+        words = detail.split()
+        if len(words) < 2 or words[0] != 'SCAN' or 'USING' in words:
+            return False
+        return words[1] not in FULL_SCAN_ALLOWED
+
+    @staticmethod
+    def seed(recipes_count: int):
+        user = User.objects.create(
+            username='plan_user', email='plan_user@example.com'
+        )
+        author = User.objects.create(
+            username='plan_author', email='plan_author@example.com'
+        )
+        Subscription.objects.create(subscriber=user, subscribed_to=author)
+        tags = [
+            Tag.objects.create(
+                name=f'plan_tag_{i}', color=f'#ABCDE{i}', slug=f'plan_{i}'
+            )
+            for i in range(3)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'plan_ingredient_{i}', measurement_unit='г')
+            for i in range(200)
+        )
+        ingredient_ids = list(
+            Ingredient.objects.filter(
+                name__startswith='plan_ingredient_'
+            ).values_list('pk', flat=True)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'plan_recipe_{i}', text='-', cooking_time=1,
+                image='recipes/images/plan.png',
+                author=(author, user)[i % 2]
+            )
+            for i in range(recipes_count)
+        )
+        recipes = list(Recipe.objects.filter(name__startswith='plan_recipe_'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tags[i % len(tags)])
+            for i, recipe in enumerate(recipes)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_ids[(i + j) % len(ingredient_ids)],
+                amount=1
+            )
+            for i, recipe in enumerate(recipes) for j in range(5)
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe) for recipe in recipes[::10]
+        )
+        shopping_list = ShoppingList.objects.create(owner=user)
+        RecipeShoppingList.objects.bulk_create(
+            RecipeShoppingList(shopping_list=shopping_list, recipe=recipe)
+            for recipe in recipes[::20]
+        )
+        return user, author, shopping_list
+
+    @staticmethod
+    def queries(user, author, shopping_list):
+        recipes = Recipe.objects.with_user_flags(user)
+        page = list(recipes.values_list('pk', flat=True)[:10])
+        return (
+            ('RecipeViewSet: список', recipes[:10]),
+            ('RecipeViewSet: рецепт', recipes.filter(pk=page[0])),
+            (
+                'RecipeFilter: author',
+                recipes.filter(author_id=author.pk)[:10]
+            ),
+            (
+                'RecipeFilter: tags',
+                recipes.filter(tags__slug__in=['plan_0']).distinct()[:10]
+            ),
+            (
+                'RecipeFilter: is_favorited',
+                recipes.filter(favorite_recipes__user=user)[:10]
+            ),
+            (
+                'RecipeFilter: is_in_shopping_cart',
+                recipes.filter(shoppinglist__owner=user)[:10]
+            ),
+            (
+                'RecipeSerializer: ингредиенты',
+                RecipeIngredient.objects.filter(
+                    recipe__in=page
+                ).select_related('ingredient')
+            ),
+            (
+                'RecipeSerializer: тэги',
+                Recipe.tags.through.objects.filter(recipe__in=page)
+            ),
+            (
+                'download_shopping_cart',
+                get_shopping_list_ingredients(shopping_list)
+            ),
+            ('UserViewSet: подписки', user.following.all()),
+            (
+                'Subscription: подписчики автора',
+                Subscription.objects.filter(subscribed_to=author)
+            ),
+            # Поиск ингредиентов (IngredientFilter) идет по индексам
+            # в памяти и к БД не обращается.
+        )
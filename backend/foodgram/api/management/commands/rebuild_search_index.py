@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.response_cache import invalidate_recipe_responses
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Заново строит индекс полнотекстового поиска рецептов.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        started = time.perf_counter()
+        with transaction.atomic():
+            count = backend.rebuild()
+            invalidate_recipe_responses()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{type(backend).__name__}: проиндексировано рецептов: {count} '
+            f'за {elapsed:.1f} с.'
+        ))
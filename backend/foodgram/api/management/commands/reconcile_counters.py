@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.signals import COUNTERS
+
+
+def count_of(model, link: str):
+    '''Число строк model, ссылающихся на объект через link.'''
+    return Coalesce(Subquery(
+        model.objects.filter(**{link: OuterRef('pk')}).order_by().values(
+            link
+        ).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики избранного, списков покупок, рецептов '
+        'и подписчиков с данными и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Число объектов в одной транзакции.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for source, (model, link, field) in COUNTERS.items():
+            last_pk = model.objects.aggregate(last=Max('pk'))['last'] or 0
+            fixed = 0
+            for start in range(0, last_pk + 1, batch_size):
+                with transaction.atomic():
+                    fixed += model.objects.filter(
+                        pk__gte=start, pk__lt=start + batch_size
+                    ).annotate(
+                        actual=count_of(source, link)
+                    ).filter(~Q(**{field: F('actual')})).update(
+                        **{field: count_of(source, link)}
+                    )
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}, {field}: '
+                f'исправлено {fixed}.'
+            )
+        self.stdout.write(self.style.SUCCESS('Счетчики сверены.'))
@@ -1,18 +1,15 @@
 from django.db import IntegrityError
+from django.utils.deprecation import MiddlewareMixin
 from rest_framework import status
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 
-class InterceptorIntegrityErrorMiddleware:
-    '''Middleware, для перехвата ошибки IntegrityError, во всем проекте.'''
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        response = self.get_response(request)
-        return response
-
+class InterceptorIntegrityErrorMiddleware(MiddlewareMixin):
+    '''
+    Middleware, для перехвата ошибки IntegrityError, во всем проекте.
+    MiddlewareMixin поддерживает и асинхронные представления.
+    '''
     def process_exception(self, request, exception):
         if isinstance(exception, IntegrityError):
             response = Response(
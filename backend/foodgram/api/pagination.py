@@ -0,0 +1,120 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class LimitOffsetCursorPagination(LimitOffsetPagination):
+    '''
+    Пагинация limit/offset, а при параметре cursor — по ключу (keyset).
+    Ключ задается атрибутом представления cursor_fields, например
+    ('-pub_date', '-id'); последнее поле должно быть уникальным.
+    Страница по курсору выбирается условием WHERE по ключу, поэтому
+    стоимость не зависит от глубины. Первая страница: ?cursor=
+    Выдачу, уже отсортированную иначе (по релевантности поиска,
+    по доле имеющихся ингредиентов), курсор не листает: ключ сортировки
+    заменил бы ее порядок, поэтому такой запрос отклоняется с 400.
+    '''
+    cursor_query_param = 'cursor'
+    cursor_fields = ('-id',)
+    invalid_cursor_message = 'Неверный курсор.'
+    ordered_queryset_message = (
+        'Курсор нельзя сочетать с сортировкой по релевантности '
+        '(search, have_ingredients), используйте limit и offset.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.limit = self.get_limit(request)
+        fields = getattr(view, 'cursor_fields', self.cursor_fields)
+        ordering = queryset.query.order_by
+        if ordering and tuple(ordering) != tuple(fields):
+            raise ValidationError(
+                {self.cursor_query_param: self.ordered_queryset_message}
+            )
+        queryset = queryset.order_by(*fields)
+        position = self.decode_cursor(request, queryset.model, fields)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(fields, position))
+        results = list(queryset[:self.limit + 1])
+        self.next_position = None
+        if len(results) > self.limit:
+            results = results[:self.limit]
+            self.next_position = [
+                getattr(results[-1], field.lstrip('-')) for field in fields
+            ]
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            response = super().get_paginated_response(data)
+        else:
+            response = Response(
+                {'next': self.get_next_link(), 'results': data}
+            )
+        # Фильтр мог ограничить выдачу (have_ingredients): клиенту
+        # сообщается, что найдено больше, чем results_limit.
+        results_limit = getattr(self.request, 'results_limit', None)
+        if results_limit is not None:
+            response.data['results_limit'] = results_limit
+        return response
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.next_position)
+        )
+
+    @staticmethod
+    def keyset_filter(fields, position) -> Q:
+        '''
+        Условие "строго после позиции" для ключа из нескольких полей:
+        (a < x) OR (a = x AND b < y) ... с учетом направления полей.
+        '''
+        condition = Q()
+        equal = {}
+        for field, value in zip(fields, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    @staticmethod
+    def encode_cursor(position) -> str:
+        # isoformat() сохраняет микросекунды, DjangoJSONEncoder их режет.
+        payload = json.dumps(position, default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, model, fields):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(fields):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(fields, position)
+            ]
+        except (
+            binascii.Error, TypeError, ValueError, DjangoValidationError
+        ):
+            raise NotFound(self.invalid_cursor_message)
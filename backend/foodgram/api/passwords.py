@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    check_password, get_hasher, identify_hasher, make_password
+)
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Хэширование паролей выполняется в отдельном пуле потоков:
+# PBKDF2 (hashlib) отпускает GIL, а размер пула ограничивает
+# число одновременных вычислений на процесс.
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+
+class PasswordHashingBusy(APIException):
+    '''Очередь хэширования паролей заполнена.'''
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервер занят, повторите запрос позже.'
+    default_code = 'password_hashing_busy'
+
+    def __init__(self):
+        super().__init__()
+        # DRF выставляет заголовок Retry-After по атрибуту wait.
+        self.wait = settings.PASSWORD_HASHING_RETRY_AFTER
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS,
+                thread_name_prefix='password-hashing'
+            )
+            _slots = threading.BoundedSemaphore(
+                settings.PASSWORD_HASHING_WORKERS
+                + settings.PASSWORD_HASHING_QUEUE_SIZE
+            )
+    return _executor
+
+
+def _submit(func, *args):
+    executor = _get_executor()
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashingBusy
+    future = executor.submit(func, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def run_hashing(func, *args):
+    '''Выполняет func в пуле хэширования и ждет результат.'''
+    return _submit(func, *args).result()
+
+
+async def arun_hashing(func, *args):
+    '''
+    Асинхронный вариант run_hashing для ASGI-представлений: ожидание
+    не занимает поток, в котором выполняется синхронный код.
+    '''
+    return await asyncio.wrap_future(_submit(func, *args))
+
+
+def _verify(raw_password: str, encoded: str):
+    '''
+    Проверяет пароль и, если хэш сделан не основным алгоритмом
+    из PASSWORD_HASHERS или с устаревшими параметрами, считает новый.
+    '''
+    if not check_password(raw_password, encoded):
+        return False, None
+    preferred = get_hasher('default')
+    hasher = identify_hasher(encoded)
+    if (
+        hasher.algorithm != preferred.algorithm
+        or preferred.must_update(encoded)
+    ):
+        return True, make_password(raw_password, hasher=preferred)
+    return True, None
+
+
+def _save_rehashed(user, encoded):
+    if encoded is not None:
+        user.password = encoded
+        user.save(update_fields=['password'])
+
+
+def hash_password(raw_password: str) -> str:
+    '''make_password в пуле хэширования.'''
+    return run_hashing(make_password, raw_password)
+
+
+def check_user_password(user, raw_password: str) -> bool:
+    '''
+    check_password в пуле хэширования. При входе пароль прозрачно
+    перехэшируется основным алгоритмом (сохранение в текущем потоке).
+    '''
+    valid, encoded = run_hashing(_verify, raw_password, user.password)
+    _save_rehashed(user, encoded)
+    return valid
+
+
+async def ahash_password(raw_password: str) -> str:
+    '''Асинхронный вариант hash_password.'''
+    return await arun_hashing(make_password, raw_password)
+
+
+async def acheck_user_password(user, raw_password: str) -> bool:
+    '''Асинхронный вариант check_user_password.'''
+    valid, encoded = await arun_hashing(_verify, raw_password, user.password)
+    if encoded is not None:
+        await sync_to_async(_save_rehashed)(user, encoded)
+    return valid
@@ -0,0 +1,102 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from api.indexes import IngredientIndex, VersionedIndex
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.models import Ingredient, Tag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+class JSONPayload(VersionedIndex):
+    '''
+    Готовое JSON-тело ответа со списком объектов и его сжатые
+    варианты (gzip, brotli, если установлен). Собирается один раз
+    на версию данных, дальше отдается из памяти без запросов к БД.
+    '''
+    queryset = None
+    serializer_class = None
+
+    def build(self) -> dict:
+        body = JSONRenderer().render(
+            self.serializer_class(self.queryset.all(), many=True).data
+        )
+        variants = {
+            None: body,
+            'gzip': gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, mode=brotli.MODE_TEXT)
+        return variants
+
+    def response(self, request) -> HttpResponse:
+        '''
+        Ответ с телом в сжатии, которое принимает клиент,
+        с долгим Cache-Control: клиенты сверяют версию по ETag.
+        '''
+        variants = self.get_data()
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if 'br' in variants and ACCEPTS_BROTLI.search(accept_encoding):
+            encoding = 'br'
+        elif ACCEPTS_GZIP.search(accept_encoding):
+            encoding = 'gzip'
+        else:
+            encoding = None
+        response = HttpResponse(
+            variants[encoding], content_type='application/json'
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_DATA_MAX_AGE
+        )
+        return response
+
+
+class TagPayload(JSONPayload):
+    '''Список всех тегов.'''
+    version_key = 'index:tags:version'
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+
+
+class IngredientPayload(JSONPayload):
+    '''Список всех ингредиентов, версия общая с индексами поиска.'''
+    version_key = IngredientIndex.version_key
+    queryset = Ingredient.objects.all()
+    serializer_class = IngredientSerializer
+
+
+tag_payload = TagPayload()
+ingredient_payload = IngredientPayload()
+
+
+class PayloadListMixin:
+    '''
+    Список без фильтров отдается готовым телом из payload,
+    минуя сериализацию. Фильтры определяет is_filtered().
+    '''
+    payload = None
+
+    def is_filtered(self, request) -> bool:
+        return False
+
+    def list(self, request, *args, **kwargs):
+        if (
+            request.accepted_renderer.format == 'json'
+            and not self.is_filtered(request)
+        ):
+            return self.payload.response(request)
+        return super().list(request, *args, **kwargs)
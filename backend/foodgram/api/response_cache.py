@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from api.versions import (
+    bump_versions, get_version, normalize_query, recipe_scope, RECIPES_SCOPE
+)
+
+
+def _response_cache():
+    return caches[settings.RECIPE_RESPONSE_CACHE]
+
+
+def invalidate_recipe_responses(*recipe_ids) -> None:
+    '''
+    Устаревают закэшированные списки рецептов и страницы
+    рецептов recipe_ids: меняются их версии.
+    '''
+    bump_versions(
+        RECIPES_SCOPE, *(recipe_scope(recipe_id) for recipe_id in recipe_ids)
+    )
+
+
+class AnonymousResponseCacheMixin:
+    '''
+    Кэш ответов list и retrieve для анонимных пользователей.
+    Ключ - версия данных, адрес и нормализованная строка запроса,
+    в кэше хранятся данные ответа до рендеринга.
+    '''
+    def get_cache_key(self, request, version) -> str:
+        return 'recipe_response:{}:{}:{}:{}?{}'.format(
+            self.action, version, request.get_host(), request.path,
+            normalize_query(request.query_params)
+        )
+
+    def cached_response(self, request, version, handler, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        cache = _response_cache()
+        key = self.get_cache_key(request, version)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, get_version(RECIPES_SCOPE),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, get_version(recipe_scope(kwargs[self.lookup_field])),
+            super().retrieve, *args, **kwargs
+        )
@@ -0,0 +1,164 @@
+import re
+from functools import lru_cache
+
+import snowballstemmer
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, QuerySet
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from api.indexes import normalize
+from recipes.models import Recipe
+
+WORD = re.compile(r'\w+')
+CYRILLIC = re.compile(r'[а-я]')
+
+_russian_stemmer = snowballstemmer.stemmer('russian')
+_english_stemmer = snowballstemmer.stemmer('english')
+
+
+@lru_cache(maxsize=100000)
+def stem(word: str) -> str:
+    '''Основа слова: русский стеммер Snowball, для латиницы английский.'''
+    if CYRILLIC.search(word):
+        return _russian_stemmer.stemWord(word)
+    return _english_stemmer.stemWord(word)
+
+
+def stems(text: str) -> list:
+    '''Основы слов текста без регистра, "ё" как "е".'''
+    return [stem(word) for word in WORD.findall(normalize(text))]
+
+
+class SearchBackend:
+    '''
+    Полнотекстовый поиск рецептов по названию и описанию.
+    index() и remove() вызываются сигналами Recipe, search()
+    сужает queryset до найденных рецептов по убыванию релевантности.
+    '''
+    def index(self, recipe: Recipe) -> None:
+        pass
+
+    def remove(self, recipe_id: int) -> None:
+        pass
+
+    def rebuild(self) -> int:
+        '''Переиндексирует все рецепты, возвращает их число.'''
+        return Recipe.objects.count()
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(SearchBackend):
+    '''
+    Инвертированный индекс SQLite FTS5 (таблица recipes_recipe_search,
+    rowid - id рецепта). В индекс пишутся основы слов, поэтому поиск
+    находит другие словоформы; слова запроса ищутся по началу основы.
+    Ранжирование bm25, совпадение в названии весит больше.
+    '''
+    table = 'recipes_recipe_search'
+    rank = f'bm25({table}, 10.0, 1.0)'
+
+    @staticmethod
+    def document(recipe: Recipe):
+        return ' '.join(stems(recipe.name)), ' '.join(stems(recipe.text))
+
+    def index(self, recipe: Recipe) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', (recipe.pk,)
+            )
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, text) '
+                f'VALUES (%s, %s, %s)',
+                (recipe.pk, *self.document(recipe))
+            )
+
+    def remove(self, recipe_id: int) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', (recipe_id,)
+            )
+
+    def rebuild(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            return self.fill(cursor, Recipe.objects.all())
+
+    def fill(self, cursor, recipes: QuerySet) -> int:
+        '''
+        Добавляет в индекс рецепты recipes через cursor. Принимает
+        и историческую модель Recipe: так таблицу заполняет миграция.
+        '''
+        count = 0
+        batch = []
+        recipes = recipes.only('name', 'text').order_by('pk')
+        for recipe in recipes.iterator(chunk_size=1000):
+            batch.append((recipe.pk, *self.document(recipe)))
+            if len(batch) >= 1000:
+                count += self._insert(cursor, batch)
+                batch = []
+        return count + self._insert(cursor, batch)
+
+    def _insert(self, cursor, batch) -> int:
+        cursor.executemany(
+            f'INSERT INTO {self.table} (rowid, name, text) '
+            f'VALUES (%s, %s, %s)',
+            batch
+        )
+        return len(batch)
+
+    @staticmethod
+    def match_expression(query: str) -> str:
+        return ' AND '.join(f'"{word}"*' for word in stems(query))
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        match = self.match_expression(query)
+        if not match:
+            return queryset
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+                (match,)
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT {self.rank} FROM {self.table} '
+                f'WHERE {self.table} MATCH %s '
+                f'AND rowid = {Recipe._meta.db_table}.id',
+                (match,)
+            )
+        ).order_by('search_rank', '-pub_date', '-id')
+
+
+class PostgresSearchBackend(SearchBackend):
+    '''
+    Поиск PostgreSQL с конфигурацией russian: индекс не нужно
+    поддерживать вручную, tsvector строится в запросе.
+    '''
+    config = 'russian'
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        from django.contrib.postgres.search import (
+            SearchQuery, SearchRank, SearchVector
+        )
+        vector = (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector('text', weight='B', config=self.config)
+        )
+        search_query = SearchQuery(
+            query, config=self.config, search_type='websearch'
+        )
+        return queryset.annotate(
+            search_rank=SearchRank(vector, search_query)
+        ).filter(search_rank__gt=0).order_by(
+            F('search_rank').desc(), '-pub_date', '-id'
+        )
+
+
+@lru_cache(maxsize=None)
+def get_search_backend() -> SearchBackend:
+    '''Бэкенд поиска из настройки RECIPE_SEARCH_BACKEND.'''
+    return import_string(settings.RECIPE_SEARCH_BACKEND)()
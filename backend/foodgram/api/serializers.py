@@ -2,12 +2,13 @@ import base64
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.auth.hashers import make_password
 from django.core.files.base import ContentFile
 from django.core.validators import MaxLengthValidator, MinLengthValidator
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
+from api.passwords import hash_password
 from recipes.models import (
     Favorite, Ingredient, Recipe,
     RecipeIngredient, ShoppingList, Tag
@@ -18,13 +19,97 @@ User = get_user_model()
 
 
 class Base64ImageField(serializers.ImageField):
-    '''Переопределенная модель поля сериализаторов для картинок.'''
+    '''
+    Переопределенная модель поля сериализаторов для картинок.
+    Размер файла проверяется до декодирования base64,
+    размеры картинки - по заголовку, без полной распаковки.
+    '''
+    default_error_messages = {
+        'too_large': 'Размер файла больше {max_size} байт.',
+        'too_big': 'Сторона картинки больше {max_side} пикселей.',
+    }
+
     def to_internal_value(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
+            if len(imgstr) // 4 * 3 > max_size:
+                self.fail('too_large', max_size=max_size)
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f'temp.{ext}')
-        return super().to_internal_value(data)
+            # Имя файла в хранилище - хэш содержимого.
+            data = ContentFile(base64.b64decode(imgstr), name=f'image.{ext}')
+        if getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
+        image = super().to_internal_value(data)
+        max_side = settings.RECIPE_IMAGE_MAX_SIDE
+        if max(image.image.size) > max_side:
+            self.fail('too_big', max_side=max_side)
+        return image
+
+
+class ImageVariantField(serializers.ImageField):
+    '''Уменьшенная копия картинки, пока ее нет - оригинал.'''
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return super().get_attribute(instance) or instance.image
+
+
+def _in_bulk(queryset, pks):
+    '''
+    Загружает объекты по списку первичных ключей одним запросом.
+    Возвращает объекты в порядке ключей и отсутствующие ключи.
+    '''
+    objects = queryset.in_bulk(set(pks))
+    missing = sorted({pk for pk in pks if pk not in objects})
+    return [objects[pk] for pk in pks if pk in objects], missing
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    '''Проверяет весь список первичных ключей одним запросом.'''
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''
+    PrimaryKeyRelatedField, который при many=True проверяет
+    все ключи одним запросом и сообщает обо всех отсутствующих.
+    '''
+    default_error_messages = {
+        'does_not_exist_many': 'Объекты с id {pk_values} не существуют.',
+    }
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value_many(self, data):
+        pks = []
+        for pk in data:
+            try:
+                if isinstance(pk, bool):
+                    raise TypeError
+                pks.append(int(pk))
+            except (TypeError, ValueError):
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+        objects, missing = _in_bulk(self.get_queryset(), pks)
+        if missing:
+            self.fail(
+                'does_not_exist_many',
+                pk_values=', '.join(map(str, missing))
+            )
+        return objects
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -52,11 +137,15 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         '''Отображение на кого подписан.'''
+        if hasattr(obj, 'is_followed'):
+            return obj.is_followed
         user = self.context.get('request').user
         return user.is_authenticated and user.is_subscribed(obj)
 
     def create(self, validated_data):
-        validated_data['password'] = make_password(
+        # Асинхронная регистрация передает готовый хэш в save().
+        encoded_password = validated_data.pop('encoded_password', None)
+        validated_data['password'] = encoded_password or hash_password(
             validated_data.get('password')
         )
         return super(UserSerializer, self).create(validated_data)
@@ -125,13 +214,40 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+    '''
+    Проверяет ингредиенты рецепта одним запросом
+    и заменяет id на объекты Ingredient.
+    '''
+    def to_internal_value(self, data):
+        ingredients_list = super().to_internal_value(data)
+        ingredients, missing = _in_bulk(
+            Ingredient.objects.all(),
+            [ingredient_dict['id'] for ingredient_dict in ingredients_list]
+        )
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты с id {} не существуют.'.format(
+                    ', '.join(map(str, missing))
+                )
+            )
+        ingredients = {ingredient.pk: ingredient for ingredient in ingredients}
+        for ingredient_dict in ingredients_list:
+            ingredient_dict['id'] = ingredients[ingredient_dict['id']]
+        return ingredients_list
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    '''Вкладываемый сериализатор для RecipeSerializer.'''
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    '''
+    Вкладываемый сериализатор для RecipeSerializer.
+    Существование ингредиентов проверяет RecipeIngredientListSerializer.
+    '''
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
+        list_serializer_class = RecipeIngredientListSerializer
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -148,7 +264,9 @@ class RecipeSerializer(serializers.ModelSerializer):
     '''Сериализатор для эндпоинта recipes.'''
     author = UserSerializer(read_only=True)
     image = Base64ImageField(required=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    image_small = ImageVariantField()
+    image_medium = ImageVariantField()
+    tags = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all(),
     )
@@ -170,12 +288,16 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_small',
+            'image_medium',
             'text',
             'cooking_time'
         )
 
     def get_is_favorited(self, obj):
         '''Есть ли рецепт в избранном.'''
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         return user.is_authenticated and Favorite.objects.filter(
             user=user,
@@ -184,6 +306,8 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
         '''Есть ли рецепт в списке покупок.'''
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         return user.is_authenticated and ShoppingList.objects.filter(
             owner=user,
@@ -213,26 +337,71 @@ class RecipeSerializer(serializers.ModelSerializer):
             )
         return tags
 
+    @staticmethod
+    def _create_ingredients(recipe, ingredients_list):
+        '''Добавляет рецепту ингредиенты одним запросом.'''
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredient_dict.get('id'),
+                amount=ingredient_dict.get('amount')
+            )
+            for ingredient_dict in ingredients_list
+        )
+
+    @staticmethod
+    def _update_ingredients(recipe, ingredients_list):
+        '''
+        Приводит ингредиенты рецепта к переданному списку:
+        удаляет лишние, добавляет новые и меняет только
+        изменившиеся количества.
+        '''
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe
+            )
+        }
+        new = {
+            ingredient_dict.get('id').id: ingredient_dict
+            for ingredient_dict in ingredients_list
+        }
+        removed = current.keys() - new.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed
+            ).delete()
+        RecipeSerializer._create_ingredients(
+            recipe,
+            [new[pk] for pk in new.keys() - current.keys()]
+        )
+        changed = []
+        for pk in new.keys() & current.keys():
+            recipe_ingredient = current[pk]
+            amount = new[pk].get('amount')
+            if recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+
+    @transaction.atomic
     def create(self, validated_data):
         tags_list = validated_data.pop('tags')
         ingredients_list = validated_data.pop('recipeingredient_set')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags_list)
-        for ingredient_dict in ingredients_list:
-            ingredient_id = ingredient_dict.get('id')
-            amount = ingredient_dict.get('amount')
-            ingredient = get_object_or_404(Ingredient, pk=ingredient_id.id)
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
-            )
+        self._create_ingredients(recipe, ingredients_list)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.image_small = instance.image_medium = ''
         instance.cooking_time = validated_data.get(
             'cooking_time',
             instance.cooking_time
@@ -240,24 +409,17 @@ class RecipeSerializer(serializers.ModelSerializer):
         tags_list = validated_data.pop('tags', None)
         ingredients_list = validated_data.pop('recipeingredient_set', None)
         if tags_list:
-            instance.tags.set(tags_list, clear=True)
+            instance.tags.set(tags_list)
         if ingredients_list:
-            RecipeIngredient.objects.filter(recipe=instance).delete()
-            for ingredient_dict in ingredients_list:
-                ingredient_id = ingredient_dict.get('id')
-                amount = ingredient_dict.get('amount')
-                ingredient = get_object_or_404(Ingredient, pk=ingredient_id.id)
-                RecipeIngredient.objects.create(
-                    recipe=instance,
-                    ingredient=ingredient,
-                    amount=amount
-                )
+            self._update_ingredients(instance, ingredients_list)
         instance.save()
         return instance
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['tags'] = TagSerializer(instance.tags, many=True).data
+        representation['tags'] = TagSerializer(
+            instance.tags.all(), many=True
+        ).data
         return representation
 
 
@@ -268,15 +430,21 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
     в избранное и список покупок.
     Выводит в ответе краткое содержимое рецепта.
     '''
+    image_small = ImageVariantField()
+    image_medium = ImageVariantField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = (
+            'id', 'name', 'image', 'image_small', 'image_medium',
+            'cooking_time'
+        )
 
 
 class SubscriptionsSerializer(UserSerializer):
     '''Сериализатор для эндпоинта users/subscriptions/.'''
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -296,14 +464,12 @@ class SubscriptionsSerializer(UserSerializer):
             serializers.ModelSerializer, self
         ).to_representation(instance)
 
-    def get_recipes_count(self, obj):
-        '''Считает кол-во рецептов пользователя.'''
-        return obj.recipes.all().count()
-
     def get_recipes(self, obj):
-        '''Выводит все рецепты пользователя.'''
+        '''Выводит рецепты пользователя, не больше recipes_limit.'''
+        if hasattr(obj, 'preview_recipes'):
+            return ShortRecipeSerializer(obj.preview_recipes, many=True).data
         recipes_limit = self.context.get('recipes_limit')
         queryset = obj.recipes.all()
-        if recipes_limit:
+        if recipes_limit is not None:
             queryset = queryset[:int(recipes_limit)]
         return ShortRecipeSerializer(queryset, many=True).data
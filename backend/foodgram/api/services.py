@@ -1,4 +1,18 @@
-from django.http import HttpResponse
+import csv
+import hashlib
+import json
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, QuerySet, Sum, Window
+from django.db.models.functions import RowNumber
+from rest_framework.exceptions import ValidationError
 # Для ПДФ
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
@@ -6,18 +20,79 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 from reportlab.platypus.paragraph import Paragraph
 
+from api.versions import bump_versions, get_version, shopping_list_scope
+from recipes.models import Recipe, RecipeIngredient, ShoppingList
+
+
+def get_recipes_limit(request) -> int | None:
+    '''Проверяет параметр recipes_limit: целое неотрицательное число.'''
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit is None:
+        return None
+    try:
+        recipes_limit = int(recipes_limit)
+        if recipes_limit < 0:
+            raise ValueError
+    except ValueError:
+        raise ValidationError(
+            {'recipes_limit': 'Должно быть целым неотрицательным числом.'}
+        )
+    return recipes_limit
+
+
+def prefetch_recipes_preview(authors: list, recipes_limit: int | None):
+    '''
+    Загружает авторам по recipes_limit последних рецептов одним запросом
+    (ROW_NUMBER() OVER (PARTITION BY author_id ...)) в preview_recipes.
+    '''
+    preview = defaultdict(list)
+    author_ids = [author.pk for author in authors]
+    if author_ids and recipes_limit != 0:
+        recipes = Recipe.objects.filter(author_id__in=author_ids)
+        if recipes_limit is not None:
+            sql, params = recipes.order_by().annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('author_id')],
+                    order_by=[F('pub_date').desc(), F('id').desc()]
+                )
+            ).query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) AS ranked '
+                f'WHERE ranked.row_number <= %s '
+                f'ORDER BY ranked.author_id, ranked.row_number',
+                (*params, recipes_limit)
+            )
+        for recipe in recipes:
+            preview[recipe.author_id].append(recipe)
+    for author in authors:
+        author.preview_recipes = preview[author.pk]
+
+
+def get_shopping_list_ingredients(shopping_list: ShoppingList) -> QuerySet:
+    '''
+    Суммирует ингредиенты всех рецептов из списка покупок
+    одним запросом с группировкой в БД.
+    Возвращает отсортированные по названию словари с ключами
+    ingredient__name, ingredient__measurement_unit и total_amount.
+    '''
+    return RecipeIngredient.objects.filter(
+        recipe__recipeshoppinglist__shopping_list=shopping_list
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount')
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
 
-def create_ingredients_pdf(ingredients: dict):
+def create_ingredients_pdf(ingredients: dict) -> bytes:
     '''
-    Функция для создания и выдачи в ответ, PDF-файла.
+    Функция для создания PDF-файла.
     На вход получает словарь с ингредиентами полученные из БД.
     '''
     # Создание PDF-документа
-    response = HttpResponse(content_type='application/pdf')
-    response[
-        'Content-Disposition'
-    ] = 'attachment; filename="shopping_list.pdf"'
-    doc = SimpleDocTemplate(response, pagesize=letter)
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
     elements = []
     # Настройка стилей для Paragraph
     styles = getSampleStyleSheet()
@@ -51,4 +126,273 @@ def create_ingredients_pdf(ingredients: dict):
     elements.append(table)
     # Построение и возврат PDF-документа
     doc.build(elements)
-    return response
+    return buffer.getvalue()
+
+
+def get_shopping_list_ingredients_dict(shopping_list: ShoppingList) -> dict:
+    '''Ингредиенты списка покупок в виде {(название, единица): количество}.'''
+    return {
+        (row['ingredient__name'], row['ingredient__measurement_unit']):
+            row['total_amount']
+        for row in get_shopping_list_ingredients(shopping_list)
+    }
+
+
+# Счетчики попаданий/промахов кэша PDF-файлов, общие для процессов.
+# Хранятся в кэше версий: он общий и не вытесняет записи по времени.
+PDF_CACHE_EVENTS = ('hits', 'misses')
+
+
+def _pdf_stats_key(event: str) -> str:
+    return f'shopping_list_pdf:stats:{event}'
+
+
+def _count_pdf_cache(event: str) -> None:
+    cache = caches[settings.VERSION_CACHE]
+    key = _pdf_stats_key(event)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_pdf_cache_stats() -> dict:
+    '''Число попаданий и промахов кэша PDF-файлов по всем процессам.'''
+    values = caches[settings.VERSION_CACHE].get_many(
+        [_pdf_stats_key(event) for event in PDF_CACHE_EVENTS]
+    )
+    return {
+        event: values.get(_pdf_stats_key(event), 0)
+        for event in PDF_CACHE_EVENTS
+    }
+
+
+def _pdf_cache():
+    return caches[settings.SHOPPING_LIST_PDF_CACHE]
+
+
+def _state_cache():
+    return caches[settings.SHOPPING_LIST_STATE_CACHE]
+
+
+def _pdf_key(digest: str) -> str:
+    return f'shopping_list_pdf:{digest}'
+
+
+def _owner_key(owner_id: int) -> str:
+    return f'shopping_list_pdf:owner:{owner_id}'
+
+
+def ingredients_digest(ingredients: dict) -> str:
+    '''Хэш содержимого списка ингредиентов, ключ кэша PDF-файла.'''
+    payload = json.dumps(
+        [[name, unit, amount] for (name, unit), amount in ingredients.items()],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def invalidate_shopping_list_pdf(*owner_ids: int) -> None:
+    '''
+    Устаревают ссылки пользователей на закэшированный PDF-файл:
+    после коммита меняется версия их списков покупок.
+    '''
+    bump_versions(*(shopping_list_scope(owner_id) for owner_id in owner_ids))
+
+
+def get_shopping_list_pdf(shopping_list: ShoppingList) -> bytes:
+    '''
+    Выдает PDF-файл списка покупок из кэша, при промахе
+    собирает ингредиенты и строит документ.
+    Файлы хранятся по хэшу содержимого, пользователь ссылается
+    на хэш своего списка вместе с версией списка. Версия читается
+    до сбора ингредиентов, поэтому изменение, закоммиченное во время
+    сбора, меняет версию, и устаревшая ссылка не используется.
+    '''
+    cache = _pdf_cache()
+    owner_key = _owner_key(shopping_list.owner_id)
+    version = get_version(shopping_list_scope(shopping_list.owner_id))
+    pointer = _state_cache().get(owner_key)
+    digest = pointer[1] if pointer and pointer[0] == version else None
+    pdf = cache.get(_pdf_key(digest)) if digest else None
+    if pdf is None:
+        ingredients = get_shopping_list_ingredients_dict(shopping_list)
+        digest = ingredients_digest(ingredients)
+        pdf = cache.get(_pdf_key(digest))
+        if pdf is None:
+            _count_pdf_cache('misses')
+            pdf = create_ingredients_pdf(ingredients)
+            cache.set(_pdf_key(digest), pdf)
+        else:
+            _count_pdf_cache('hits')
+        _state_cache().set(owner_key, (version, digest))
+    else:
+        _count_pdf_cache('hits')
+    return pdf
+
+
+# Фоновая генерация PDF-файлов в пуле процессов.
+# Состояние задач хранится в общем кэше SHOPPING_LIST_STATE_CACHE,
+# готовый файл кладется в кэш PDF-файлов по хэшу содержимого.
+# Пул и счетчик очереди у каждого процесса сервера свои.
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+_pdf_jobs_pending = 0
+
+
+class PDFQueueFull(Exception):
+    '''Очередь фоновой генерации PDF-файлов заполнена.'''
+
+
+def _job_key(job_id: str) -> str:
+    return f'shopping_list_pdf:job:{job_id}'
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(
+                max_workers=settings.SHOPPING_LIST_PDF_WORKERS
+            )
+        return _pdf_executor
+
+
+def _reset_pdf_executor(executor: ProcessPoolExecutor) -> None:
+    '''Сломанный пул (упал процесс) заменяется новым при следующей задаче.'''
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False)
+
+
+def _submit_pdf(ingredients: dict):
+    executor = _get_pdf_executor()
+    try:
+        return executor.submit(create_ingredients_pdf, ingredients), executor
+    except BrokenProcessPool:
+        _reset_pdf_executor(executor)
+    executor = _get_pdf_executor()
+    return executor.submit(create_ingredients_pdf, ingredients), executor
+
+
+def _finish_pdf_job(job: dict, executor, future) -> None:
+    global _pdf_jobs_pending
+    with _pdf_executor_lock:
+        _pdf_jobs_pending -= 1
+    error = None if future.cancelled() else future.exception()
+    if future.cancelled() or error is not None:
+        job['status'] = 'failed'
+        if isinstance(error, BrokenProcessPool):
+            _reset_pdf_executor(executor)
+    else:
+        _pdf_cache().set(_pdf_key(job['digest']), future.result())
+        job['status'] = 'done'
+    _state_cache().set(_job_key(job['id']), job)
+
+
+def submit_shopping_list_pdf_job(shopping_list: ShoppingList) -> dict:
+    '''
+    Ставит генерацию PDF-файла списка покупок в пул процессов.
+    Если файл с таким содержимым уже есть в кэше, задача сразу готова.
+    Вызывает PDFQueueFull, если в очереди нет места.
+    '''
+    global _pdf_jobs_pending
+    jobs = _state_cache()
+    ingredients = get_shopping_list_ingredients_dict(shopping_list)
+    digest = ingredients_digest(ingredients)
+    job = {
+        'id': uuid.uuid4().hex,
+        'owner_id': shopping_list.owner_id,
+        'digest': digest,
+        'status': 'done',
+    }
+    if _pdf_cache().get(_pdf_key(digest)) is not None:
+        _count_pdf_cache('hits')
+        jobs.set(_job_key(job['id']), job)
+        return job
+    with _pdf_executor_lock:
+        if _pdf_jobs_pending >= settings.SHOPPING_LIST_PDF_QUEUE_SIZE:
+            raise PDFQueueFull
+        _pdf_jobs_pending += 1
+    _count_pdf_cache('misses')
+    job['status'] = 'pending'
+    jobs.set(_job_key(job['id']), job)
+    try:
+        future, executor = _submit_pdf(ingredients)
+    except BaseException:
+        with _pdf_executor_lock:
+            _pdf_jobs_pending -= 1
+        jobs.delete(_job_key(job['id']))
+        raise
+    future.add_done_callback(
+        lambda done: _finish_pdf_job(dict(job), executor, done)
+    )
+    return job
+
+
+def get_shopping_list_pdf_job(job_id: str, owner_id: int):
+    '''
+    Возвращает задачу пользователя и готовый PDF-файл (или None).
+    Если задачи нет, возвращает (None, None).
+    '''
+    job = _state_cache().get(_job_key(job_id))
+    if job is None or job['owner_id'] != owner_id:
+        return None, None
+    pdf = None
+    if job['status'] == 'done':
+        pdf = _pdf_cache().get(_pdf_key(job['digest']))
+        if pdf is None:
+            job['status'] = 'expired'
+    return job, pdf
+
+
+class _Echo:
+    '''Псевдо-буфер для csv.writer: возвращает записанную строку.'''
+    def write(self, value: str) -> str:
+        return value
+
+
+def _stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['Ингредиент', 'Система измерения', 'Количество'])
+    for name, unit, amount in rows:
+        yield writer.writerow([name, unit, amount])
+
+
+def _stream_txt(rows):
+    yield 'Список покупок\n\n'
+    for name, unit, amount in rows:
+        yield f'{name} ({unit}) — {amount}\n'
+
+
+def _stream_json(rows):
+    yield '['
+    separator = ''
+    for name, unit, amount in rows:
+        yield separator + json.dumps(
+            {'name': name, 'measurement_unit': unit, 'amount': amount},
+            ensure_ascii=False
+        )
+        separator = ', '
+    yield ']'
+
+
+SHOPPING_LIST_STREAMS = {
+    'csv': _stream_csv,
+    'txt': _stream_txt,
+    'json': _stream_json,
+}
+
+
+def stream_shopping_list(shopping_list: ShoppingList, export_format: str):
+    '''
+    Генератор выгрузки списка покупок в формате csv, txt или json.
+    Строки читаются из БД порциями, память не зависит от размера списка.
+    '''
+    rows = get_shopping_list_ingredients(shopping_list).values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+    ).iterator(chunk_size=settings.SHOPPING_LIST_STREAM_CHUNK_SIZE)
+    return SHOPPING_LIST_STREAMS[export_format](rows)
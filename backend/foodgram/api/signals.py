@@ -0,0 +1,267 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_tokens
+from api.indexes import IngredientIndex, RecipeIngredientIndex
+from api.payloads import TagPayload
+from api.response_cache import invalidate_recipe_responses
+from api.search import get_search_backend
+from api.services import invalidate_shopping_list_pdf
+from api.versions import (
+    bump_versions, INGREDIENTS_SCOPE, TAGS_SCOPE, user_scope, USERS_SCOPE
+)
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, RecipeShoppingList,
+    ShoppingList, Tag
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+# Счетчики: модель строки -> (модель со счетчиком, ссылка, поле счетчика).
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    RecipeShoppingList: (Recipe, 'recipe_id', 'in_carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Subscription: (User, 'subscribed_to_id', 'subscribers_count'),
+}
+
+
+# Отложенная до коммита обработка рецептов, измененных в транзакции
+# текущего потока.
+_pending = threading.local()
+
+
+def _recipes_committed(recipe_ids):
+    '''
+    Сброс кэшей PDF-файлов у владельцев списков покупок с рецептами,
+    кэша ответов и обновление индекса ингредиент -> рецепты.
+    '''
+    owner_ids = ShoppingList.objects.filter(
+        recipe__in=recipe_ids
+    ).order_by().values_list('owner_id', flat=True).distinct()
+    invalidate_shopping_list_pdf(*owner_ids)
+    invalidate_recipe_responses(*recipe_ids)
+    RecipeIngredientIndex.record_changes(*recipe_ids)
+
+
+def _recipe_changed(recipe_id):
+    '''
+    Копит id рецептов, измененных в транзакции, и обрабатывает их
+    одним вызовом после коммита: замена десятков ингредиентов
+    не дает десятков запросов и записей в кэш. Обработка, отброшенная
+    вместе с откатом транзакции, уже не ждет коммита (ее нет
+    в connection.run_on_commit) - тогда копится новая пачка.
+    '''
+    flush = getattr(_pending, 'flush', None)
+    if flush is not None and any(
+        func is flush
+        for _, func in transaction.get_connection().run_on_commit
+    ):
+        flush.recipe_ids.add(recipe_id)
+        return
+
+    def flush():
+        if getattr(_pending, 'flush', None) is flush:
+            _pending.flush = None
+        _recipes_committed(flush.recipe_ids)
+
+    flush.recipe_ids = {recipe_id}
+    _pending.flush = flush
+    transaction.on_commit(flush)
+
+
+def _invalidate_recipe_responses_by(**lookups):
+    invalidate_recipe_responses(
+        *Recipe.objects.filter(**lookups).values_list('pk', flat=True)
+    )
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=RecipeShoppingList)
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=Subscription)
+def counter_changed(sender, instance, signal, created=False, **kwargs):
+    '''
+    Пересчет счетчика при создании и удалении строки: F() выполняется
+    в БД, без гонок между запросами. Создание обернуто в транзакцию
+    вызывающим кодом, удаление Django выполняет в транзакции сам,
+    так что счетчик меняется вместе со строкой.
+    Расхождения исправляет команда reconcile_counters.
+    '''
+    if signal is post_save and not created:
+        return
+    model, link, field = COUNTERS[sender]
+    counters = model.objects.filter(pk=getattr(instance, link))
+    if signal is post_save:
+        counters.update(**{field: F(field) + 1})
+    else:
+        counters.filter(**{f'{field}__gt': 0}).update(**{field: F(field) - 1})
+
+
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=RecipeShoppingList)
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Subscription)
+def counter_moved(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''
+    Перенос существующей строки на другой объект (смена автора рецепта
+    в админке): счетчик прежнего объекта уменьшается, нового - растет.
+    Прежняя ссылка читается одним запросом при изменении строки.
+    '''
+    model, link, field = COUNTERS[sender]
+    if raw or instance._state.adding or (
+        update_fields is not None
+        and not {link, link.removesuffix('_id')} & update_fields
+    ):
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list(
+        link, flat=True
+    ).first()
+    new = getattr(instance, link)
+    if old is None or old == new:
+        return
+    model.objects.filter(pk=old, **{f'{field}__gt': 0}).update(
+        **{field: F(field) - 1}
+    )
+    model.objects.filter(pk=new).update(**{field: F(field) + 1})
+
+
+@receiver((post_save, post_delete), sender=RecipeShoppingList)
+def shopping_list_changed(sender, instance, **kwargs):
+    '''
+    Сброс кэша PDF-файла при изменении списка покупок
+    и версии личных отметок владельца.
+    '''
+    owner_id = ShoppingList.objects.filter(
+        pk=instance.shopping_list_id
+    ).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        invalidate_shopping_list_pdf(owner_id)
+        bump_versions(user_scope(owner_id))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def favorite_changed(sender, instance, **kwargs):
+    '''Новая версия личных отметок пользователя.'''
+    bump_versions(user_scope(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    '''Новая версия личных отметок подписчика.'''
+    bump_versions(user_scope(instance.subscriber_id))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    '''
+    Изменение строк ингредиентов в обход сериализатора (админка,
+    удаление строк, каскад): рецепт обрабатывается после коммита.
+    '''
+    _recipe_changed(instance.recipe_id)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    '''
+    Сохранение и удаление рецепта: сериализатор пишет ингредиенты
+    пакетно, без сигналов RecipeIngredient, и затем сохраняет рецепт.
+    '''
+    _recipe_changed(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_search_index(sender, instance, **kwargs):
+    '''Переиндексация рецепта для поиска, в той же транзакции.'''
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_search_remove(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''
+    Сброс кэша ответов при изменении тегов рецепта, в том числе
+    со стороны тега (tag.recipe_set).
+    '''
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_recipe_responses(instance.pk)
+        return
+    if action in ('post_add', 'post_remove'):
+        invalidate_recipe_responses(*pk_set)
+    elif action == 'pre_clear':
+        _invalidate_recipe_responses_by(tags=instance)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    '''Новое название или цвет тега меняет ответы с его рецептами.'''
+    if not created:
+        _invalidate_recipe_responses_by(tags=instance)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    '''Связи рецептов с тегом удаляются каскадом, без m2m_changed.'''
+    _invalidate_recipe_responses_by(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    '''Новые ингредиенты догружаются в индексы поиска, иначе перестроение.'''
+    IngredientIndex.invalidate(created=created)
+    bump_versions(INGREDIENTS_SCOPE)
+    if not created:
+        _invalidate_recipe_responses_by(ingredients=instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    '''Перестроение индексов поиска ингредиентов.'''
+    IngredientIndex.invalidate()
+    bump_versions(INGREDIENTS_SCOPE)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    '''Пересборка готового списка тегов.'''
+    TagPayload.invalidate()
+    bump_versions(TAGS_SCOPE)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    '''Выход и смена пароля: токен убирается из кэша аутентификации.'''
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    '''
+    Изменение пользователя (в том числе деактивация):
+    закэшированный вместе с токеном объект устарел.
+    '''
+    if not created:
+        invalidate_tokens(
+            *Token.objects.filter(user=instance).values_list('key', flat=True)
+        )
+        _invalidate_recipe_responses_by(author=instance)
+
+
+@receiver((post_save, post_delete), sender=User)
+def users_changed(sender, **kwargs):
+    '''Новая версия списка пользователей.'''
+    bump_versions(USERS_SCOPE)
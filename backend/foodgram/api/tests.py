@@ -0,0 +1,1258 @@
+import base64
+import importlib
+import io
+import json
+import tempfile
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncRequestFactory, override_settings, TestCase
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from api import async_views, indexes, services
+from api.authentication import _token_key, CachedTokenAuthentication
+from api.passwords import PasswordHashingBusy
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient,
+    RecipeShoppingList, ShoppingList, Tag
+)
+from recipes.tests import TEST_CACHES
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def image_data() -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 3), 'red').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class CommitMixin:
+    @classmethod
+    @contextmanager
+    def committed(cls):
+        '''
+        Выполняет on_commit блока, как после коммита, в том числе
+        добавленные самими обработчиками. В setUpTestData не дает
+        обработке изменений ждать коммита, которого в тестах нет.
+        '''
+        with cls.captureOnCommitCallbacks() as callbacks:
+            yield
+        while callbacks:
+            with cls.captureOnCommitCallbacks() as added:
+                for callback in callbacks:
+                    callback()
+            callbacks = added
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryCountTests(APITestCase):
+    '''Число запросов к API не зависит от числа рецептов на странице.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(3)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г'
+            )
+            for i in range(10)
+        ]
+        shopping_list = ShoppingList.objects.create(owner=cls.user)
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {i}', text='Текст', cooking_time=5,
+                author=authors[i % 3], image=f'recipes/images/{i}.png'
+            )
+            recipe.tags.set(tags[:i % 3 + 1])
+            for ingredient in ingredients[i % 5:i % 5 + 3]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            else:
+                RecipeShoppingList.objects.create(
+                    shopping_list=shopping_list, recipe=recipe
+                )
+        for author in authors:
+            Subscription.objects.create(
+                subscriber=cls.user, subscribed_to=author
+            )
+        cls.recipe = recipe
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assert_queries(self, num, url, data=None):
+        with self.assertNumQueries(num):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recipe_list(self):
+        response = self.assert_queries(
+            5, reverse('api:recipe-list'), {'limit': 6}
+        )
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_recipe_detail(self):
+        self.assert_queries(4, reverse(
+            'api:recipe-detail', kwargs={'pk': self.recipe.pk}
+        ))
+
+    def test_subscriptions(self):
+        response = self.assert_queries(
+            3, reverse('api:customuser-user-subscriptions'),
+            {'limit': 3, 'recipes_limit': 2}
+        )
+        self.assertEqual(len(response.data['results']), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TokenCacheTests(APITestCase):
+    '''Выход, смена пароля и деактивация сбрасывают кэш токенов.'''
+    def setUp(self):
+        self.cache = caches[settings.AUTH_TOKEN_CACHE]
+        self.cache.clear()
+        self.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.key = self.token.key
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        response = self.client.get(reverse('api:customuser-user-me'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(self.cached())
+
+    def cached(self):
+        return self.cache.get(_token_key(self.key))
+
+    def assert_token_rejected(self):
+        self.assertIsNone(self.cached())
+        response = self.client.get(reverse('api:customuser-user-me'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api:logout'))
+        self.assertEqual(response.status_code, 204)
+        self.assert_token_rejected()
+
+    def test_set_password(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('api:customuser-set-password'),
+                {'current_password': 'password', 'new_password': 'NewPass123'}
+            )
+        self.assertEqual(response.status_code, 204)
+        self.assert_token_rejected()
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertIsNone(self.cached())
+
+    def test_queries(self):
+        request = APIRequestFactory().get(
+            '/', HTTP_AUTHORIZATION=f'Token {self.key}'
+        )
+        self.cache.clear()
+        for authentication, queries in (
+            (TokenAuthentication(), 1),
+            (TokenAuthentication(), 1),
+            (CachedTokenAuthentication(), 1),
+            (CachedTokenAuthentication(), 0),
+        ):
+            with self.subTest(authentication=type(authentication).__name__):
+                with self.assertNumQueries(queries):
+                    user, token = authentication.authenticate(request)
+                self.assertEqual((user, token), (self.user, self.token))
+
+    def test_recached_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.token.delete()
+                # Параллельный запрос успел закэшировать токен до коммита.
+                self.cache.set(_token_key(self.key), (self.user, self.token))
+        self.assert_token_rejected()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncPasswordViewTests(TestCase):
+    '''
+    Асинхронные вход, регистрация и смена пароля ждут хэширование
+    в цикле событий, а не в общем потоке (run_hashing не вызывается).
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        caches[settings.AUTH_TOKEN_CACHE].clear()
+        self.factory = AsyncRequestFactory()
+
+    async def post(self, view, path, data, **extra):
+        request = self.factory.post(
+            path, data, content_type='application/json', **extra
+        )
+        with mock.patch(
+            'api.passwords.run_hashing',
+            side_effect=AssertionError('хэширование в общем потоке')
+        ):
+            return await view(request)
+
+    async def test_login(self):
+        path = reverse('api:login')
+        data = {'email': 'reader@foodgram.ru', 'password': 'password'}
+        response = await self.post(async_views.login_user, path, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.token.key, response.content.decode())
+        response = await self.post(
+            async_views.login_user, path, {**data, 'password': 'wrong'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_registration(self):
+        response = await self.post(
+            async_views.user_list, reverse('api:customuser-list'), {
+                'email': 'new@foodgram.ru', 'username': 'new',
+                'first_name': 'Имя', 'last_name': 'Фамилия',
+                'password': 'NewPass123',
+            }
+        )
+        self.assertEqual(response.status_code, 201)
+        user = await sync_to_async(User.objects.get)(username='new')
+        self.assertTrue(user.check_password('NewPass123'))
+
+    async def test_set_password(self):
+        path = reverse('api:customuser-set-password')
+        data = {'current_password': 'password', 'new_password': 'NewPass123'}
+        response = await self.post(async_views.set_password, path, data)
+        self.assertEqual(response.status_code, 401)
+        response = await self.post(
+            async_views.set_password, path, data,
+            authorization=f'Token {self.token.key}'
+        )
+        self.assertEqual(response.status_code, 204)
+        user = await sync_to_async(User.objects.get)(pk=self.user.pk)
+        self.assertTrue(user.check_password('NewPass123'))
+        self.assertFalse(
+            await sync_to_async(Token.objects.filter(user=user).exists)()
+        )
+
+    async def test_busy(self):
+        with mock.patch(
+            'api.passwords._submit', side_effect=PasswordHashingBusy
+        ):
+            response = await self.post(
+                async_views.login_user, reverse('api:login'),
+                {'email': 'reader@foodgram.ru', 'password': 'password'}
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeWriteQueryCountTests(CommitMixin, APITestCase):
+    '''
+    Число запросов при записи рецепта, включая обработку после коммита,
+    не зависит от числа ингредиентов.
+    '''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i}', measurement_unit='г')
+            for i in range(80)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        images = mock.patch('api.views.schedule_recipe_images')
+        images.start()
+        self.addCleanup(images.stop)
+        self.client.force_authenticate(self.user)
+
+    def recipe_data(self, ingredients, amount=10) -> dict:
+        return {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient in ingredients
+            ],
+        }
+
+    def create_recipe(self, ingredients) -> int:
+        with self.committed():
+            response = self.client.post(
+                reverse('api:recipe-list'),
+                {**self.recipe_data(ingredients), 'image': image_data()},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def update_recipe(self, num, pk, data):
+        with self.assertNumQueries(num), self.committed():
+            response = self.client.patch(
+                reverse('api:recipe-detail', kwargs={'pk': pk}), data,
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            RecipeIngredient.objects.filter(recipe=pk).count(),
+            len(data['ingredients'])
+        )
+
+    def test_create(self):
+        for ingredients in (self.ingredients[:4], self.ingredients[:40]):
+            with self.subTest(ingredients=len(ingredients)):
+                with self.assertNumQueries(17):
+                    self.create_recipe(ingredients)
+
+    def test_replace_ingredients(self):
+        pk = self.create_recipe(self.ingredients[:40])
+        self.update_recipe(22, pk, self.recipe_data(self.ingredients[40:]))
+
+    def test_change_amounts(self):
+        pk = self.create_recipe(self.ingredients[:40])
+        self.update_recipe(
+            20, pk, self.recipe_data(self.ingredients[:40], amount=20)
+        )
+
+    def test_batch_after_rollback(self):
+        pk = self.create_recipe(self.ingredients[:2])
+        with mock.patch('api.signals._recipes_committed') as committed:
+            with self.committed():
+                with self.assertRaises(ValueError):
+                    with transaction.atomic():
+                        RecipeIngredient.objects.filter(recipe=pk).delete()
+                        raise ValueError
+                RecipeIngredient.objects.create(
+                    recipe_id=pk, ingredient=self.ingredients[50], amount=1
+                )
+        committed.assert_called_once_with({pk})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingCartDownloadTests(APITestCase):
+    '''Ошибки выгрузки списка покупок отдаются как application/json.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.url = reverse('api:recipe-download-shopping-cart')
+
+    def assert_json_error(self, status_code, data=None):
+        response = self.client.get(self.url, data)
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+
+    def test_anonymous(self):
+        for data in (None, {'format': 'csv'}, {'format': 'txt'}):
+            with self.subTest(data=data):
+                self.assert_json_error(401, data)
+
+    def test_no_shopping_list(self):
+        self.client.force_authenticate(self.user)
+        for data in (None, {'format': 'csv'}, {'async': '1'}):
+            with self.subTest(data=data):
+                self.assert_json_error(404, data)
+
+    def test_file(self):
+        ShoppingList.objects.create(owner=self.user)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Type'], 'text/csv; charset=utf-8'
+        )
+
+    @mock.patch('api.views.submit_shopping_list_pdf_job')
+    def test_async_flag(self, submit):
+        submit.return_value = {'id': '0' * 32, 'status': 'pending'}
+        ShoppingList.objects.create(owner=self.user)
+        self.client.force_authenticate(self.user)
+        for value, status_code in (
+            ('1', 202), ('true', 202), ('0', 200), ('false', 200), ('', 200)
+        ):
+            with self.subTest(value=value):
+                response = self.client.get(self.url, {'async': value})
+                self.assertEqual(response.status_code, status_code)
+        self.assertEqual(submit.call_count, 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingCartQueryCountTests(APITestCase):
+    '''Число запросов выгрузки не зависит от числа рецептов в списке.'''
+    SIZES = (1, 50, 500)
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i:02}', measurement_unit='г')
+            for i in range(40)
+        )
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'Рецепт {i}', text='Текст', cooking_time=5,
+                author=author, image=f'recipes/images/{i}.png'
+            )
+            for i in range(max(cls.SIZES))
+        )
+        recipes = list(Recipe.objects.order_by('pk'))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=ingredients[(i + j) % 40],
+                amount=j + 1
+            )
+            for i, recipe in enumerate(recipes) for j in range(8)
+        )
+        cls.users = {}
+        for size in cls.SIZES:
+            user = User.objects.create_user(
+                username=f'shopper{size}', email=f'shopper{size}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            shopping_list = ShoppingList.objects.create(owner=user)
+            RecipeShoppingList.objects.bulk_create(
+                RecipeShoppingList(shopping_list=shopping_list, recipe=recipe)
+                for recipe in recipes[:size]
+            )
+            cls.users[size] = user
+        cls.url = reverse('api:recipe-download-shopping-cart')
+
+    def setUp(self):
+        caches[settings.SHOPPING_LIST_PDF_CACHE].clear()
+
+    def download(self, size, export_format):
+        self.client.force_authenticate(self.users[size])
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'format': export_format})
+            content = b''.join(response)
+        self.assertEqual(response.status_code, 200)
+        return content
+
+    def test_growing_carts(self):
+        for size in self.SIZES:
+            for export_format in ('csv', 'txt', 'json', 'pdf'):
+                with self.subTest(size=size, format=export_format):
+                    self.download(size, export_format)
+
+    def test_totals(self):
+        # В рецепте i ингредиенты (i + j) % 40 в количестве j + 1.
+        rows = json.loads(self.download(500, 'json'))
+        self.assertEqual(len(rows), 40)
+        self.assertEqual(
+            sum(row['amount'] for row in rows),
+            500 * sum(range(1, 9))
+        )
+        self.assertEqual(rows[0], {
+            'name': 'Продукт 00', 'measurement_unit': 'г',
+            'amount': sum(
+                j + 1 for i in range(500) for j in range(8)
+                if (i + j) % 40 == 0
+            ),
+        })
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingListPDFCacheTests(CommitMixin, TestCase):
+    '''Ссылка на PDF-файл не переживает изменения списка покупок.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт', text='Текст', cooking_time=5,
+            author=cls.user, image='recipes/images/0.png'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Продукт', measurement_unit='г'
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=1
+        )
+        cls.shopping_list = ShoppingList.objects.create(owner=cls.user)
+        RecipeShoppingList.objects.create(
+            shopping_list=cls.shopping_list, recipe=cls.recipe
+        )
+
+    def setUp(self):
+        for name in (
+            settings.SHOPPING_LIST_PDF_CACHE,
+            settings.SHOPPING_LIST_STATE_CACHE, settings.VERSION_CACHE,
+        ):
+            caches[name].clear()
+        self.real_aggregate = services.get_shopping_list_ingredients_dict
+        aggregate = mock.patch.object(
+            services, 'get_shopping_list_ingredients_dict',
+            wraps=self.real_aggregate
+        )
+        self.aggregate = aggregate.start()
+        self.addCleanup(aggregate.stop)
+
+    def get_pdf(self) -> bytes:
+        return services.get_shopping_list_pdf(self.shopping_list)
+
+    def test_cached_until_changed(self):
+        pdf = self.get_pdf()
+        self.assertEqual(self.get_pdf(), pdf)
+        self.assertEqual(self.aggregate.call_count, 1)
+        with self.committed():
+            RecipeIngredient.objects.filter(recipe=self.recipe).update(
+                amount=2
+            )
+            services.invalidate_shopping_list_pdf(self.user.pk)
+        self.assertNotEqual(self.get_pdf(), pdf)
+        self.assertEqual(self.aggregate.call_count, 2)
+
+    def test_change_during_aggregation(self):
+        def aggregate_and_change(shopping_list):
+            ingredients = self.real_aggregate(shopping_list)
+            # Изменение закоммичено, пока строился файл по старым данным.
+            with self.committed():
+                RecipeIngredient.objects.filter(recipe=self.recipe).update(
+                    amount=2
+                )
+                services.invalidate_shopping_list_pdf(self.user.pk)
+            return ingredients
+
+        self.aggregate.side_effect = aggregate_and_change
+        stale = self.get_pdf()
+        self.aggregate.side_effect = None
+        self.assertNotEqual(self.get_pdf(), stale)
+        self.assertEqual(self.aggregate.call_count, 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IngredientPrefixIndexTests(APITestCase):
+    '''Поиск ингредиентов по началу названия идет из индекса, без БД.'''
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'Сыр', 'Сыр твердый', 'сыр плавленый', 'Сырок',
+                'Ёжевика', 'Мука', 'Масло сливочное'
+            )
+        )
+        cls.url = reverse('api:ingredient-list')
+
+    def setUp(self):
+        caches[settings.VERSION_CACHE].clear()
+        indexes.ingredient_prefix_index._snapshot = None
+
+    def search(self, name, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(self.url, {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()]
+
+    def test_queries(self):
+        self.search('Сыр', 1)
+        self.search('Сыр', 0)
+        self.search('Мука', 0)
+        indexes.IngredientIndex._set_version(
+            indexes.IngredientIndex.version_key
+        )
+        self.search('Сыр', 1)
+
+    def test_same_rows_as_scan(self):
+        names = Ingredient.objects.values_list('name', flat=True)
+        for name in ('С', 'Сыр', 'Сыр т', 'м', 'Масло', 'Хлеб'):
+            with self.subTest(name=name):
+                self.assertCountEqual(
+                    self.search(name, 0 if name != 'С' else 1), [
+                        found for found in names
+                        if indexes.normalize(found).startswith(
+                            indexes.normalize(name)
+                        )
+                    ]
+                )
+
+    def test_order_and_case(self):
+        # Сначала точное совпадение, затем более короткие названия;
+        # регистр и "ё" не учитываются, в отличие от LIKE в SQLite.
+        self.assertEqual(
+            self.search('сыр', 1),
+            ['Сыр', 'Сырок', 'Сыр твердый', 'сыр плавленый']
+        )
+        self.assertEqual(self.search('ежев', 0), ['Ёжевика'])
+
+    def test_new_ingredient(self):
+        self.search('Сыр', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Сыворотка', measurement_unit='г')
+        self.assertEqual(self.search('Сыв', 1), ['Сыворотка'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CursorPaginationTests(APITestCase):
+    '''Постраничный вывод по курсору (?cursor=) рецептов и подписок.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(5)
+        ]
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(2)
+        ]
+        ingredient = Ingredient.objects.create(
+            name='Капуста', measurement_unit='г'
+        )
+        shopping_list = ShoppingList.objects.create(owner=cls.user)
+        for i in range(9):
+            recipe = Recipe.objects.create(
+                name=f'Щи {i}', text='Капуста', cooking_time=5,
+                author=cls.authors[i % 2], image=f'recipes/images/{i}.png'
+            )
+            recipe.tags.set(tags[:i % 3])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                RecipeShoppingList.objects.create(
+                    shopping_list=shopping_list, recipe=recipe
+                )
+        # Пять рецептов с одинаковым временем публикации.
+        Recipe.objects.filter(pk__in=Recipe.objects.order_by('pk').values(
+            'pk'
+        )[2:7]).update(pub_date=Recipe.objects.earliest('pk').pub_date)
+        for author in cls.authors:
+            Subscription.objects.create(
+                subscriber=cls.user, subscribed_to=author
+            )
+        cls.ingredient = ingredient
+
+    def setUp(self):
+        caches[settings.VERSION_CACHE].clear()
+        indexes.recipe_ingredient_index._snapshot = None
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, data=None, limit=2) -> list:
+        '''id всех записей по ссылкам next, начиная с ?cursor='''
+        ids = []
+        response = self.client.get(
+            url, {**(data or {}), 'cursor': '', 'limit': limit}
+        )
+        while True:
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['results']
+            self.assertLessEqual(len(results), limit)
+            ids += [row['id'] for row in results]
+            if response.json()['next'] is None:
+                return ids
+            response = self.client.get(response.json()['next'])
+
+    def expected(self, data=None) -> list:
+        '''Та же выдача без курсора, в порядке ключа (-pub_date, -id).'''
+        response = self.client.get(
+            reverse('api:recipe-list'), {**(data or {}), 'limit': 100}
+        )
+        return list(Recipe.objects.filter(
+            pk__in=[row['id'] for row in response.json()['results']]
+        ).order_by('-pub_date', '-id').values_list('pk', flat=True))
+
+    def test_tied_pub_date(self):
+        ids = self.walk(reverse('api:recipe-list'))
+        self.assertEqual(len(ids), 9)
+        self.assertEqual(ids, self.expected())
+
+    def test_invalid_cursor(self):
+        for cursor in (
+            'не base64', base64.urlsafe_b64encode(b'[1]').decode(),
+            base64.urlsafe_b64encode(b'["not a date", 1]').decode(),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    reverse('api:recipe-list'), {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_filters(self):
+        for data in (
+            {'author': self.authors[0].pk},
+            {'tags': 'tag0'},
+            {'tags': ['tag0', 'tag1']},
+            {'is_favorited': 1},
+            {'is_favorited': 0},
+            {'is_in_shopping_cart': 1},
+            {'is_in_shopping_cart': 0},
+        ):
+            with self.subTest(data=data):
+                expected = self.expected(data)
+                self.assertTrue(expected)
+                self.assertEqual(
+                    self.walk(reverse('api:recipe-list'), data), expected
+                )
+
+    def test_ranked_filters(self):
+        for data in (
+            {'search': 'капуста'},
+            {'have_ingredients': self.ingredient.pk},
+            {'have_ingredients': self.ingredient.pk, 'tags': 'tag1'},
+        ):
+            with self.subTest(data=data):
+                response = self.client.get(
+                    reverse('api:recipe-list'), {**data, 'cursor': ''}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+                self.assertEqual(self.client.get(
+                    reverse('api:recipe-list'), data
+                ).status_code, 200)
+
+    def test_subscriptions(self):
+        self.assertEqual(
+            self.walk(reverse('api:customuser-user-subscriptions')),
+            sorted((author.pk for author in self.authors), reverse=True)
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class HaveIngredientsTests(CommitMixin, APITestCase):
+    '''Подбор рецептов по имеющимся ингредиентам (?have_ingredients=).'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru',
+            password='password', first_name='Имя', last_name='Фамилия'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(2)
+        ]
+        tag = Tag.objects.create(name='Тэг', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г'
+            )
+            for i in range(5)
+        ]
+        cls.recipes = []
+        with cls.committed():
+            cls.create_recipes(tag)
+
+    @classmethod
+    def create_recipes(cls, tag):
+        for i, count in enumerate((2, 3, 4, 0)):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {i}', text='Текст', cooking_time=5,
+                author=cls.authors[i % 2], image=f'recipes/images/{i}.png'
+            )
+            if i % 2 == 0:
+                recipe.tags.add(tag)
+            for ingredient in cls.ingredients[:count]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+            cls.recipes.append(recipe)
+        RecipeIngredient.objects.create(
+            recipe=cls.recipes[3], ingredient=cls.ingredients[4], amount=1
+        )
+
+    def setUp(self):
+        caches[settings.VERSION_CACHE].clear()
+        indexes.recipe_ingredient_index._snapshot = None
+        self.client.force_authenticate(self.user)
+
+    def search(self, ingredients=3, status_code=200, **data):
+        response = self.client.get(reverse('api:recipe-list'), {
+            'have_ingredients': ','.join(
+                str(ingredient.pk)
+                for ingredient in self.ingredients[:ingredients]
+            ),
+            'limit': 100,
+            **data
+        })
+        self.assertEqual(response.status_code, status_code)
+        return response.json()
+
+    def found(self, **data) -> list:
+        recipe_numbers = {
+            recipe.pk: number for number, recipe in enumerate(self.recipes)
+        }
+        return [
+            recipe_numbers[row['id']]
+            for row in self.search(**data)['results']
+        ]
+
+    def test_ranking(self):
+        # Рецепты 0 и 1 собираются полностью, в рецепте 2 не хватает
+        # одного ингредиента; при равной доле новые рецепты выше.
+        self.assertEqual(self.found(), [1, 0])
+        self.assertEqual(self.found(max_missing=1), [1, 0, 2])
+        self.assertEqual(self.found(ingredients=1, max_missing=3), [0, 1, 2])
+
+    def test_other_filters(self):
+        self.assertEqual(self.found(max_missing=1, tags='tag'), [0, 2])
+        self.assertEqual(
+            self.found(max_missing=1, author=self.authors[1].pk), [1]
+        )
+        self.assertEqual(self.found(author=self.authors[0].pk), [0])
+
+    def test_validation(self):
+        for data in (
+            {'max_missing': -1},
+            {'max_missing': 'abc'},
+            {'have_ingredients': '1,x'},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(
+                    list(self.search(status_code=400, **data)),
+                    [next(iter(data))]
+                )
+        with override_settings(HAVE_INGREDIENTS_MAX_IDS=2):
+            self.search(status_code=400)
+
+    def test_results_limit(self):
+        self.assertNotIn('results_limit', self.search(max_missing=1))
+        with override_settings(HAVE_INGREDIENTS_LIMIT=2):
+            response = self.search(max_missing=1)
+        self.assertEqual(response['results_limit'], 2)
+        self.assertEqual(
+            [row['id'] for row in response['results']],
+            [self.recipes[1].pk, self.recipes[0].pk]
+        )
+
+    def test_incremental_update(self):
+        # Журнал изменений уже начат, как на работающем сервере: первая
+        # запись в пустой журнал перестраивает индекс целиком.
+        caches[settings.VERSION_CACHE].set(
+            indexes.RecipeIngredientIndex.sequence_key, 0, None
+        )
+        self.assertEqual(self.found(), [1, 0])
+        data = indexes.recipe_ingredient_index.get_data()
+        with self.committed():
+            RecipeIngredient.objects.create(
+                recipe=self.recipes[3], ingredient=self.ingredients[0],
+                amount=1
+            )
+            RecipeIngredient.objects.filter(
+                recipe=self.recipes[1], ingredient=self.ingredients[2]
+            ).delete()
+        self.assertEqual(self.found(max_missing=1), [1, 0, 2, 3])
+        self.assertIs(indexes.recipe_ingredient_index.get_data(), data)
+        with self.committed():
+            recipe = Recipe.objects.create(
+                name='Новый', text='Текст', cooking_time=5,
+                author=self.authors[0], image='recipes/images/new.png'
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredients[1], amount=1
+            )
+        self.assertIn(
+            recipe.pk,
+            [row['id'] for row in self.search()['results']]
+        )
+        self.assertIs(indexes.recipe_ingredient_index.get_data(), data)
+
+    def test_sizes(self):
+        data = indexes.RecipeIngredientPostings(0)
+        for recipe_id, ingredients in ((9, (1, 2)), (3, (1,)), (12, ())):
+            data.set_recipe(recipe_id, ingredients)
+        self.assertEqual(
+            list(data.sizes), [0, 0, 0, 1] + [0] * 5 + [2, 0, 0, 0]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CounterTests(TestCase):
+    '''Счетчики избранного, списков покупок, рецептов и подписчиков.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.other = (
+            User.objects.create_user(
+                username=name, email=f'{name}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for name in ('reader', 'author', 'other')
+        )
+        cls.shopping_list = ShoppingList.objects.create(owner=cls.user)
+
+    def setUp(self):
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Текст', cooking_time=5,
+            author=self.author, image='recipes/images/0.png'
+        )
+
+    def assert_counters(self, **expected):
+        objects = {
+            'favorites_count': self.recipe,
+            'in_carts_count': self.recipe,
+            'recipes_count': self.author,
+            'subscribers_count': self.author,
+        }
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                objects[field].refresh_from_db(fields=[field])
+                self.assertEqual(getattr(objects[field], field), value)
+
+    def create_rows(self) -> list:
+        return [
+            Favorite.objects.create(user=self.user, recipe=self.recipe),
+            RecipeShoppingList.objects.create(
+                shopping_list=self.shopping_list, recipe=self.recipe
+            ),
+            Subscription.objects.create(
+                subscriber=self.user, subscribed_to=self.author
+            ),
+        ]
+
+    def test_create_and_delete(self):
+        self.assert_counters(recipes_count=1)
+        rows = self.create_rows()
+        self.assert_counters(
+            favorites_count=1, in_carts_count=1, recipes_count=1,
+            subscribers_count=1
+        )
+        for row in rows:
+            row.delete()
+        self.assert_counters(
+            favorites_count=0, in_carts_count=0, recipes_count=1,
+            subscribers_count=0
+        )
+        self.recipe.delete()
+        self.assert_counters(recipes_count=0)
+
+    def test_not_below_zero(self):
+        rows = self.create_rows()
+        Recipe.objects.update(favorites_count=0, in_carts_count=0)
+        User.objects.update(recipes_count=0, subscribers_count=0)
+        for row in rows:
+            row.delete()
+        self.assert_counters(
+            favorites_count=0, in_carts_count=0, recipes_count=0,
+            subscribers_count=0
+        )
+        self.recipe.delete()
+        self.assert_counters(recipes_count=0)
+
+    def test_author_change(self):
+        self.recipe.author = self.other
+        self.recipe.save()
+        self.assert_counters(recipes_count=0)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.recipes_count, 1)
+        # Сохранение без смены автора счетчики не трогает.
+        self.recipe.name = 'Новое название'
+        self.recipe.save()
+        self.recipe.save(update_fields=['name'])
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.recipes_count, 1)
+
+    def test_reconcile_counters(self):
+        self.create_rows()
+        Recipe.objects.update(favorites_count=5, in_carts_count=0)
+        User.objects.update(recipes_count=3, subscribers_count=0)
+        out = io.StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=out)
+        self.assert_counters(
+            favorites_count=1, in_carts_count=1, recipes_count=1,
+            subscribers_count=1
+        )
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.recipes_count, 0)
+        self.assertIn('исправлено 1.', out.getvalue())
+        self.assertIn('исправлено 3.', out.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AnonymousResponseCacheTests(CommitMixin, APITestCase):
+    '''Изменения данных сбрасывают кэш ответов рецептов для анонимов.'''
+    @classmethod
+    def setUpTestData(cls):
+        with cls.committed():
+            cls.author = User.objects.create_user(
+                username='author', email='author@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            cls.tags = [
+                Tag.objects.create(
+                    name=f'Тэг {i}', color=f'#00000{i}', slug=f'tag{i}'
+                )
+                for i in range(2)
+            ]
+            cls.ingredients = [
+                Ingredient.objects.create(
+                    name=f'Продукт {i}', measurement_unit='г'
+                )
+                for i in range(2)
+            ]
+            cls.recipe = Recipe.objects.create(
+                name='Рецепт', text='Текст', cooking_time=5,
+                author=cls.author, image='recipes/images/0.png'
+            )
+            cls.recipe.tags.add(cls.tags[0])
+            cls.recipe_ingredient = RecipeIngredient.objects.create(
+                recipe=cls.recipe, ingredient=cls.ingredients[0], amount=1
+            )
+
+    def setUp(self):
+        for name in (settings.RECIPE_RESPONSE_CACHE, settings.VERSION_CACHE):
+            caches[name].clear()
+        self.urls = (
+            reverse('api:recipe-list'),
+            reverse('api:recipe-detail', kwargs={'pk': self.recipe.pk}),
+        )
+
+    def get(self) -> list:
+        '''Рецепт из списка и со страницы рецепта.'''
+        recipes = []
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            recipes.append(data['results'][0] if url == self.urls[0] else data)
+        return recipes
+
+    def assert_refreshed(self, change, check):
+        self.get()
+        with self.assertNumQueries(0):
+            self.get()
+        with self.committed():
+            change()
+        for recipe in self.get():
+            check(recipe)
+
+    def test_recipe(self):
+        def change():
+            self.recipe.name = 'Новое название'
+            self.recipe.save()
+        self.assert_refreshed(change, lambda recipe: self.assertEqual(
+            recipe['name'], 'Новое название'
+        ))
+
+    def test_recipe_ingredient(self):
+        def change():
+            self.recipe_ingredient.amount = 7
+            self.recipe_ingredient.save()
+            RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=self.ingredients[1], amount=2
+            )
+        self.assert_refreshed(change, lambda recipe: self.assertEqual(
+            sorted(row['amount'] for row in recipe['ingredients']), [2, 7]
+        ))
+
+    def assert_tags(self, change, slugs):
+        self.assert_refreshed(change, lambda recipe: self.assertEqual(
+            sorted(tag['slug'] for tag in recipe['tags']), slugs
+        ))
+
+    def test_tags(self):
+        for change, slugs in (
+            (lambda: self.recipe.tags.add(self.tags[1]), ['tag0', 'tag1']),
+            (lambda: self.recipe.tags.remove(self.tags[0]), ['tag1']),
+            (lambda: self.recipe.tags.clear(), []),
+        ):
+            with self.subTest(slugs=slugs):
+                self.assert_tags(change, slugs)
+
+    def test_tags_reverse(self):
+        for change, slugs in (
+            (lambda: self.tags[1].recipe_set.add(self.recipe),
+             ['tag0', 'tag1']),
+            (lambda: self.tags[0].recipe_set.remove(self.recipe), ['tag1']),
+            (lambda: self.tags[1].recipe_set.clear(), []),
+        ):
+            with self.subTest(slugs=slugs):
+                self.assert_tags(change, slugs)
+
+    def test_tag_and_ingredient(self):
+        def change():
+            self.tags[0].name = 'Новый тэг'
+            self.tags[0].save()
+            self.ingredients[0].name = 'Новый продукт'
+            self.ingredients[0].save()
+
+        def check(recipe):
+            self.assertEqual(recipe['tags'][0]['name'], 'Новый тэг')
+            self.assertEqual(recipe['ingredients'][0]['name'], 'Новый продукт')
+        self.assert_refreshed(change, check)
+
+    def test_author_profile(self):
+        def change():
+            self.author.first_name = 'Новое имя'
+            self.author.save()
+        self.assert_refreshed(change, lambda recipe: self.assertEqual(
+            recipe['author']['first_name'], 'Новое имя'
+        ))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeSearchTests(APITestCase):
+    '''Полнотекстовый поиск рецептов (?search=) по основам слов.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            for i in range(2)
+        ]
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#000000', slug='lunch'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                name=name, text=text, cooking_time=5,
+                author=cls.authors[i % 2], image=f'recipes/images/{i}.png'
+            )
+            for i, (name, text) in enumerate((
+                ('Щи с капустой', 'Варить говядину'),
+                ('Салат', 'Нарезать капусту и морковь'),
+                ('Капустные котлеты', 'Обжарить'),
+                ('Борщ', 'Свекла и картофель'),
+            ))
+        ]
+        cls.recipes[1].tags.add(cls.tag)
+        cls.recipes[2].tags.add(cls.tag)
+
+    def setUp(self):
+        caches[settings.VERSION_CACHE].clear()
+
+    def found(self, **data) -> set:
+        response = self.client.get(
+            reverse('api:recipe-list'), {'limit': 100, **data}
+        )
+        self.assertEqual(response.status_code, 200)
+        numbers = {recipe.pk: i for i, recipe in enumerate(self.recipes)}
+        return {numbers[row['id']] for row in response.json()['results']}
+
+    def test_word_forms(self):
+        # Основа слова запроса ищется по началу: "капуст" находит
+        # и "капустн" (капустные).
+        for query in ('капуста', 'Капусту', 'капустой'):
+            with self.subTest(query=query):
+                self.assertEqual(self.found(search=query), {0, 1, 2})
+        self.assertEqual(self.found(search='картофеля'), {3})
+        self.assertEqual(self.found(search='говядина щи'), {0})
+
+    def test_other_filters(self):
+        self.assertEqual(
+            self.found(search='капуста', author=self.authors[1].pk), {1}
+        )
+        self.assertEqual(self.found(search='капуста', tags='lunch'), {1, 2})
+        self.assertEqual(
+            self.found(
+                search='капусту', tags='lunch', author=self.authors[0].pk
+            ),
+            {2}
+        )
+        self.assertEqual(
+            self.found(search='картофель', tags='lunch'), set()
+        )
+
+    def test_name_ranked_first(self):
+        self.recipes[3].name = 'Борщ с капустой'
+        self.recipes[3].save()
+        response = self.client.get(
+            reverse('api:recipe-list'), {'search': 'капуста', 'limit': 100}
+        )
+        self.assertEqual(
+            [row['id'] for row in response.json()['results']][-1],
+            self.recipes[1].pk
+        )
+
+    def test_migration_fills_table(self):
+        migration = importlib.import_module(
+            'recipes.migrations.0009_recipe_search_index'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM recipes_recipe_search')
+        self.assertEqual(self.found(search='капуста'), set())
+        migration.fill_search_table(
+            django_apps, SimpleNamespace(connection=connection)
+        )
+        self.assertEqual(self.found(search='капустой'), {0, 1, 2})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryPlanTests(TestCase):
+    '''Основные запросы API не читают таблицы целиком.'''
+    def test_check_query_plans(self):
+        stdout = io.StringIO()
+        call_command('check_query_plans', recipes=200, stdout=stdout)
+        self.assertIn('Все запросы используют индексы.', stdout.getvalue())
+        self.assertFalse(Recipe.objects.exists())
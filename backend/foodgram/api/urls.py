@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework import routers
 
+from api import async_views
 from api.views import (
     IngredientViewSet, login_user, logout_user, RecipeViewSet,
     subscribe, TagViewSet, UserViewSet,
@@ -20,3 +22,19 @@ urlpatterns = [
     path('auth/token/logout/', logout_user, name='logout'),
     path('users/<int:user_id>/subscribe/', subscribe, name='subscribe'),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    # Под ASGI рецепты, теги, ингредиенты, а также вход, регистрацию
+    # и смену пароля (хэширование без блокировки общего потока)
+    # обслуживают асинхронные представления, остальные - прежние.
+    urlpatterns = [
+        path('auth/token/login/', async_views.login_user),
+        path('users/', async_views.user_list),
+        path('users/set_password/', async_views.set_password),
+        path('recipes/', async_views.recipe_list),
+        path('recipes/<int:pk>/', async_views.recipe_detail),
+        path('tags/', async_views.tag_list),
+        path('tags/<int:pk>/', async_views.tag_detail),
+        path('ingredients/', async_views.ingredient_list),
+        path('ingredients/<int:pk>/', async_views.ingredient_detail),
+    ] + urlpatterns
@@ -0,0 +1,94 @@
+import hashlib
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Области данных, версии которых отслеживаются.
+RECIPES_SCOPE = 'recipes'
+TAGS_SCOPE = 'tags'
+INGREDIENTS_SCOPE = 'ingredients'
+USERS_SCOPE = 'users'
+
+
+def recipe_scope(pk) -> str:
+    '''Отдельный рецепт.'''
+    return f'recipe:{pk}'
+
+
+def user_scope(pk) -> str:
+    '''Личные отметки пользователя: избранное, покупки, подписки.'''
+    return f'user:{pk}'
+
+
+def shopping_list_scope(owner_id) -> str:
+    '''Состав списка покупок пользователя: рецепты и их ингредиенты.'''
+    return f'shopping_list:{owner_id}'
+
+
+def _version_cache():
+    return caches[settings.VERSION_CACHE]
+
+
+def _version_key(scope) -> str:
+    return f'version:{scope}'
+
+
+def get_versions(*scopes) -> list:
+    '''
+    Версии данных (время последнего изменения в наносекундах)
+    для областей scopes одним обращением к кэшу. Если версии нет
+    или она вытеснена, отсчет начинается с текущего времени.
+    '''
+    cache = _version_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, time.time_ns()) for key in keys]
+
+
+def get_version(scope) -> int:
+    return get_versions(scope)[0]
+
+
+def _set_versions(scopes) -> None:
+    cache = _version_cache()
+    keys = [_version_key(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    now = time.time_ns()
+    cache.set_many({key: max(now, current.get(key, 0) + 1) for key in keys})
+
+
+def bump_versions(*scopes) -> None:
+    '''
+    Отмечает изменение данных областей scopes. Версии меняются после
+    коммита транзакции, чтобы не опередить запись в БД.
+    '''
+    if scopes:
+        transaction.on_commit(lambda: _set_versions(scopes))
+
+
+def get_version_stamp(scopes, *parts):
+    '''
+    ETag и время последнего изменения (в секундах) ответа,
+    зависящего от данных scopes и параметров запроса parts.
+    '''
+    versions = get_versions(*scopes)
+    digest = hashlib.sha1(
+        repr((tuple(scopes), versions, parts)).encode()
+    ).hexdigest()
+    return f'"{digest}"', max(versions) // 10 ** 9
+
+
+def normalize_query(query_params) -> str:
+    '''Строка запроса с отсортированными параметрами и значениями.'''
+    return urlencode(
+        sorted(parse_qsl(query_params.urlencode(), keep_blank_values=True))
+    )
@@ -1,34 +1,59 @@
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import permissions, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.renderers import JSONRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from api.conditional import ConditionalGetMixin
 from api.filters import RecipeFilter, IngredientFilter
+from api.images import schedule_recipe_images
+from api.pagination import LimitOffsetCursorPagination
+from api.passwords import check_user_password, hash_password
+from api.payloads import ingredient_payload, PayloadListMixin, tag_payload
 from api.permissions import IsAuthorPermissions
-from api.services import create_ingredients_pdf
+from api.renderers import (
+    CSVRenderer, PDFRenderer, PlainTextRenderer, ShoppingListRenderer
+)
+from api.response_cache import AnonymousResponseCacheMixin
+from api.services import (
+    get_pdf_cache_stats, get_recipes_limit, get_shopping_list_pdf,
+    get_shopping_list_pdf_job, PDFQueueFull, prefetch_recipes_preview,
+    stream_shopping_list, submit_shopping_list_pdf_job
+)
 from api.serializers import (
     IngredientSerializer, LoginSerializer, RecipeSerializer,
     SetPasswordSerializer, ShortRecipeSerializer, SubscriptionsSerializer,
     TagSerializer, UserSerializer
 )
+from api.versions import (
+    INGREDIENTS_SCOPE, recipe_scope, RECIPES_SCOPE, TAGS_SCOPE, USERS_SCOPE
+)
 from recipes.models import (
     Favorite, Ingredient, Recipe,
-    ShoppingList, RecipeIngredient,
-    RecipeShoppingList, Tag
+    ShoppingList, RecipeShoppingList, Tag
 )
 
 User = get_user_model()
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     '''Представление для эндпоинта users.'''
     queryset = User.objects.all()
     serializer_class = UserSerializer
     http_method_names = ['get', 'post']
+    pagination_class = LimitOffsetCursorPagination
+    cursor_fields = ('-id',)
+
+    def get_version_scopes(self):
+        return (USERS_SCOPE,)
 
     def get_permissions(self):
         if self.action == 'create':
@@ -55,23 +80,13 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def set_password(self, request: Request):
         '''Меняет текущий пароль пользователя, на новый.'''
-        serializer = SetPasswordSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        user = request.user
-        current_password = serializer.validated_data.get('current_password')
-        new_password = serializer.validated_data.get('new_password')
-        if user.check_password(current_password):
-            user.auth_token.delete()
-            user.set_password(new_password)
-            user.save(update_fields=['password'])
-            return Response(
-                data={'message': 'Пароль успешно изменен.'},
-                status=status.HTTP_204_NO_CONTENT
-            )
-        return Response(
-            data=serializer.errors,
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        user, current_password, new_password = read_password_change(request)
+        password = None
+        if check_user_password(user, current_password):
+            # Хэш считается до изменений: при занятом пуле (503)
+            # пароль и токен пользователя остаются прежними.
+            password = hash_password(new_password)
+        return change_password(user, password)
 
     @action(
         methods=['GET'],
@@ -85,9 +100,10 @@ class UserViewSet(viewsets.ModelViewSet):
         подписан текущий пользователь.
         '''
         user = request.user
-        subscriptions = user.following.all()
-        recipes_limit = request.query_params.get('recipes_limit')
+        subscriptions = user.following.with_is_followed(user).order_by('-id')
+        recipes_limit = get_recipes_limit(request)
         page = self.paginate_queryset(subscriptions)
+        prefetch_recipes_preview(page, recipes_limit)
         serializer = SubscriptionsSerializer(
             page,
             many=True,
@@ -104,15 +120,17 @@ def subscribe(request: Request, user_id: int):
     Подписывает/отписывает пользователя на/от другого ползователя.
     '''
     user = request.user
-    user_to_follow = get_object_or_404(User, pk=user_id)
-    recipes_limit = request.query_params.get('recipes_limit')
-    serializer = SubscriptionsSerializer(
-        user_to_follow,
-        context={'request': request, 'recipes_limit': recipes_limit},
-    )
     if request.method == 'POST':
+        recipes_limit = get_recipes_limit(request)
+        user_to_follow = get_object_or_404(User, pk=user_id)
+        prefetch_recipes_preview([user_to_follow], recipes_limit)
         user.subscribe(user_to_follow)
+        serializer = SubscriptionsSerializer(
+            user_to_follow,
+            context={'request': request, 'recipes_limit': recipes_limit},
+        )
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
+    user_to_follow = get_object_or_404(User, pk=user_id)
     if not user.is_subscribed(user_to_follow):
         return Response(
             data={'error': 'Вы не были подписаны на этого пользователя.'},
@@ -122,36 +140,70 @@ def subscribe(request: Request, user_id: int):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-@api_view(['POST'])
-@permission_classes([permissions.AllowAny])
-def login_user(request: Request):
+def read_password_change(request: Request) -> tuple:
+    '''Пользователь, текущий и новый пароли из запроса смены пароля.'''
+    serializer = SetPasswordSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return (
+        request.user,
+        serializer.validated_data.get('current_password'),
+        serializer.validated_data.get('new_password'),
+    )
+
+
+def change_password(user, password) -> Response:
     '''
-    Представление для авторизации пользователя.
-    (Получение токена авторизации).
+    Сохраняет хэш нового пароля и удаляет токен пользователя.
+    password=None - текущий пароль указан неверно.
     '''
+    if password is None:
+        return Response(data={}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        user.password = password
+        user.save(update_fields=['password'])
+        Token.objects.filter(user=user).delete()
+    return Response(
+        data={'message': 'Пароль успешно изменен.'},
+        status=status.HTTP_204_NO_CONTENT
+    )
+
+
+def read_login(request: Request) -> tuple:
+    '''Пользователь (None, если не найден) и пароль из запроса входа.'''
     serializer = LoginSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
     email = serializer.validated_data.get('email')
     password = serializer.validated_data.get('password')
-    try:
-        user = User.objects.get(email=email)
-    except User.DoesNotExist:
+    return User.objects.filter(email=email).first(), password
+
+
+def login_response(user) -> Response:
+    '''Токен пользователя; user=None - неверные email или пароль.'''
+    if user is None:
         return Response(
             data={'error': 'Проверьте корректность веденных данных'},
             status=status.HTTP_400_BAD_REQUEST
         )
-    if user.check_password(password):
-        token, _ = Token.objects.get_or_create(user=user)
-        return Response(
-            data={'auth_token': token.key},
-            status=status.HTTP_200_OK
-        )
+    token, _ = Token.objects.get_or_create(user=user)
     return Response(
-        data={'error': 'Проверьте корректность веденных данных'},
-        status=status.HTTP_400_BAD_REQUEST
+        data={'auth_token': token.key},
+        status=status.HTTP_200_OK
     )
 
 
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+def login_user(request: Request):
+    '''
+    Представление для авторизации пользователя.
+    (Получение токена авторизации).
+    '''
+    user, password = read_login(request)
+    if user is not None and not check_user_password(user, password):
+        user = None
+    return login_response(user)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def logout_user(request: Request):
@@ -160,14 +212,22 @@ def logout_user(request: Request):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    ConditionalGetMixin, PayloadListMixin, viewsets.ReadOnlyModelViewSet
+):
     '''Представление для эндпоинта tags.'''
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    payload = tag_payload
+
+    def get_version_scopes(self):
+        return (TAGS_SCOPE,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ConditionalGetMixin, AnonymousResponseCacheMixin, viewsets.ModelViewSet
+):
     '''Представление для эндпоинта recipes.'''
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
@@ -177,14 +237,42 @@ class RecipeViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'delete', 'patch']
     filter_backends = (DjangoFilterBackend,)
     filter_class = RecipeFilter
+    pagination_class = LimitOffsetCursorPagination
+    cursor_fields = ('-pub_date', '-id')
 
     def get_permissions(self):
         if self.action == 'retrieve':
             return (permissions.IsAuthenticatedOrReadOnly(),)
         return super().get_permissions()
 
+    def get_queryset(self):
+        user = self.request.user
+        return Recipe.objects.with_user_flags(user).with_related(user)
+
+    def get_version_scopes(self):
+        if self.action == 'retrieve':
+            return (recipe_scope(self.kwargs[self.lookup_field]),)
+        return (RECIPES_SCOPE,)
+
     def perform_create(self, serializer):
-        return serializer.save(author=self.request.user)
+        serializer.save(author=self.request.user)
+        schedule_recipe_images(serializer.instance.pk)
+        self._reload_instance(serializer)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        if 'image' in serializer.validated_data:
+            schedule_recipe_images(serializer.instance.pk)
+        self._reload_instance(serializer)
+
+    def _reload_instance(self, serializer):
+        '''
+        Перечитывает сохраненный рецепт с аннотациями и подгрузкой,
+        чтобы ответ строился фиксированным числом запросов.
+        '''
+        serializer.instance = self.get_queryset().get(
+            pk=serializer.instance.pk
+        )
 
     @action(
         methods=['POST', 'DELETE'],
@@ -201,7 +289,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
             context={'request': request}
         )
         if request.method == 'POST':
-            Favorite.objects.create(user=user, recipe=recipe)
+            with transaction.atomic():
+                Favorite.objects.create(user=user, recipe=recipe)
             return Response(
                 data=serializer.data,
                 status=status.HTTP_201_CREATED
@@ -233,10 +322,11 @@ class RecipeViewSet(viewsets.ModelViewSet):
             owner=user
         )
         if request.method == 'POST':
-            RecipeShoppingList.objects.create(
-                shopping_list=shopping_list_obj,
-                recipe=recipe
-            )
+            with transaction.atomic():
+                RecipeShoppingList.objects.create(
+                    shopping_list=shopping_list_obj,
+                    recipe=recipe
+                )
             return Response(
                 data=serializer.data,
                 status=status.HTTP_201_CREATED)
@@ -256,38 +346,129 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=['GET'],
         detail=False,
         url_path='download_shopping_cart',
-        permission_classes=(permissions.IsAuthenticated,)
+        permission_classes=(permissions.IsAuthenticated,),
+        renderer_classes=(
+            PDFRenderer, CSVRenderer, PlainTextRenderer, JSONRenderer
+        )
     )
     def download_shopping_cart(self, request: Request):
-        '''Выдает PDF-файл для скачивания.'''
+        '''
+        Выдает список покупок для скачивания.
+        PDF по умолчанию, csv/txt/json по ?format= или заголовку Accept.
+        С ?async=1 PDF-файл строится в фоне, в ответ выдается id задачи.
+        '''
         shopping_list = get_object_or_404(
             ShoppingList,
             owner=request.user
         )
-        recipe_shopping_list = RecipeShoppingList.objects.filter(
-            shopping_list=shopping_list
+        renderer = request.accepted_renderer
+        if renderer.format == 'pdf' and self.is_async(request):
+            return self._submit_pdf_job(request, shopping_list)
+        if renderer.format == 'pdf':
+            response = HttpResponse(
+                get_shopping_list_pdf(shopping_list),
+                content_type=renderer.media_type
+            )
+        else:
+            response = StreamingHttpResponse(
+                stream_shopping_list(shopping_list, renderer.format),
+                content_type=f'{renderer.media_type}; charset=utf-8'
+            )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
+
+    @staticmethod
+    def is_async(request: Request) -> bool:
+        return request.query_params.get('async') in ('1', 'true')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        '''
+        Файл выгрузки отдается как HttpResponse, а ответы DRF этого
+        действия (ошибки 401/404/406, задача фоновой генерации) - JSON,
+        и отдаются как application/json, а не как формат файла.
+        '''
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if isinstance(response, Response) and isinstance(
+            response.accepted_renderer, ShoppingListRenderer
+        ):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    def _submit_pdf_job(self, request: Request, shopping_list: ShoppingList):
+        try:
+            job = submit_shopping_list_pdf_job(shopping_list)
+        except PDFQueueFull:
+            return Response(
+                data={'error': 'Сервер занят, повторите запрос позже.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={
+                    'Retry-After': settings.SHOPPING_LIST_PDF_RETRY_AFTER
+                }
+            )
+        location = request.build_absolute_uri(
+            reverse(
+                'api:recipe-download_shopping_cart_job',
+                kwargs={'job_id': job['id']}
+            )
+        )
+        return Response(
+            data={'id': job['id'], 'status': job['status']},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': location}
         )
-        ingredients: dict[str, str | int] = {}
-        for rsl in recipe_shopping_list:
-            recipe_ingredients = RecipeIngredient.objects.filter(
-                recipe=rsl.recipe
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f]{32})',
+        url_name='download_shopping_cart_job',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def download_shopping_cart_job(self, request: Request, job_id: str):
+        '''Статус фоновой генерации PDF-файла, готовый файл.'''
+        job, pdf = get_shopping_list_pdf_job(job_id, request.user.id)
+        if job is None:
+            return Response(
+                data={'error': 'Задача не найдена.'},
+                status=status.HTTP_404_NOT_FOUND
             )
-            for ri in recipe_ingredients:
-                ingredient_name = ri.ingredient.name
-                ingredient_unit = ri.ingredient.measurement_unit
-                if (ingredient_name, ingredient_unit) in ingredients:
-                    ingredients[
-                        (ingredient_name, ingredient_unit)
-                    ] += ri.amount
-                else:
-                    ingredients[(ingredient_name, ingredient_unit)] = ri.amount
-        return create_ingredients_pdf(ingredients)
-
-
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+        if pdf is None:
+            return Response(data={'id': job['id'], 'status': job['status']})
+        response = HttpResponse(pdf, content_type='application/pdf')
+        response[
+            'Content-Disposition'
+        ] = 'attachment; filename="shopping_list.pdf"'
+        return response
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='download_shopping_cart/stats',
+        permission_classes=(permissions.IsAdminUser,)
+    )
+    def download_shopping_cart_stats(self, request: Request):
+        '''Попадания и промахи кэша PDF-файлов, только для администраторов.'''
+        return Response(data=get_pdf_cache_stats())
+
+
+class IngredientViewSet(
+    ConditionalGetMixin, PayloadListMixin, viewsets.ReadOnlyModelViewSet
+):
     '''Представление для эндпоинта ingredients.'''
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (IngredientFilter,)
     search_fields = ('^name',)
+    payload = ingredient_payload
+
+    def get_version_scopes(self):
+        return (INGREDIENTS_SCOPE,)
+
+    def is_filtered(self, request):
+        return bool(request.query_params.get('name', '').strip())
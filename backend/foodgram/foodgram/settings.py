@@ -2,6 +2,8 @@ import os
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -72,7 +74,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -89,6 +91,148 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Общий для всех процессов кэш - memcached (нужен pymemcache), адрес
+# задается в MEMCACHED_LOCATION. Он вытесняет давно не читанные записи
+# (LRU) и не обходит каталоги, как FileBasedCache, на каждой записи.
+# Без memcached сервер запускается только при DEBUG, и общие кэши живут
+# в памяти процесса: сервер должен работать в одном процессе, а изменения
+# из команд manage.py он увидит только после перезапуска.
+MEMCACHED_LOCATION = os.getenv('MEMCACHED_LOCATION')
+
+if not MEMCACHED_LOCATION and not DEBUG:
+    raise ImproperlyConfigured(
+        'Для общих кэшей нужен memcached: задайте MEMCACHED_LOCATION.'
+    )
+
+
+def shared_cache(name: str, timeout, max_entries: int) -> dict:
+    if MEMCACHED_LOCATION:
+        # Размер ограничен памятью memcached, MAX_ENTRIES он не знает.
+        return {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MEMCACHED_LOCATION,
+            'KEY_PREFIX': name,
+            'TIMEOUT': timeout,
+        }
+    return {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': name,
+        'TIMEOUT': timeout,
+        'OPTIONS': {
+            'MAX_ENTRIES': max_entries,
+        },
+    }
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Сгенерированные PDF-файлы списков покупок по хэшу содержимого.
+    # Только файлы: вытесняются давно не читанные (LRU у memcached
+    # и LocMemCache), ограничение числа записей относится только к ним.
+    'shopping_list_pdf': shared_cache(
+        'shopping_list_pdf', timeout=60 * 60 * 24, max_entries=500
+    ),
+    # Ссылки пользователей на их последний PDF-файл и состояние фоновых
+    # задач. Общий для процессов: опрос задачи может попасть в другой
+    # процесс, чем тот, что ее принял.
+    'shopping_list_state': shared_cache(
+        'shopping_list_state', timeout=60 * 60 * 24, max_entries=20000
+    ),
+    # Ответы API рецептов для анонимных пользователей. Ключ содержит
+    # версию данных из общего кэша versions, поэтому кэш ответов может
+    # оставаться в памяти процесса: после изменения данных процессы
+    # просто перестают обращаться к старым ключам.
+    'recipe_responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe_responses',
+        'TIMEOUT': 60 * 10,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Версии данных (время последнего изменения) для кэша ответов
+    # и условных GET-запросов, хранятся без срока. Должен быть общим
+    # для всех процессов: иначе другие процессы и команды не видят
+    # изменений и отдают устаревшие ответы и 304.
+    'versions': shared_cache(
+        'versions', timeout=None, max_entries=100000
+    ),
+    # Токены аутентификации. Общий для процессов: выход и смена пароля
+    # должны сразу действовать во всех процессах, а не через TIMEOUT.
+    'auth_tokens': shared_cache(
+        'auth_tokens', timeout=60 * 5, max_entries=10000
+    ),
+}
+
+SHOPPING_LIST_PDF_CACHE = 'shopping_list_pdf'
+
+SHOPPING_LIST_STATE_CACHE = 'shopping_list_state'
+
+AUTH_TOKEN_CACHE = 'auth_tokens'
+
+RECIPE_RESPONSE_CACHE = 'recipe_responses'
+
+VERSION_CACHE = 'versions'
+
+SHOPPING_LIST_STREAM_CHUNK_SIZE = 500
+
+# Фоновая генерация PDF-файлов: число процессов и размер очереди.
+# Пул и очередь у каждого процесса сервера свои, так что всего
+# в очереди может быть SHOPPING_LIST_PDF_QUEUE_SIZE на процесс.
+SHOPPING_LIST_PDF_WORKERS = 2
+
+SHOPPING_LIST_PDF_QUEUE_SIZE = 20
+
+SHOPPING_LIST_PDF_RETRY_AFTER = 5
+
+# Нечеткий поиск ингредиентов: порог сходства и размер выдачи.
+INGREDIENT_FUZZY_THRESHOLD = 0.3
+
+INGREDIENT_FUZZY_LIMIT = 10
+
+INGREDIENT_FUZZY_MAX_LIMIT = 50
+
+# Ограничения загружаемых картинок рецептов: размер файла в байтах
+# и наибольшая сторона в пикселях.
+RECIPE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+
+RECIPE_IMAGE_MAX_SIDE = 4096
+
+# Уменьшенные копии картинок рецептов (WebP), ширина и высота.
+RECIPE_IMAGE_SIZES = {
+    'small': (200, 200),
+    'medium': (600, 400),
+}
+
+RECIPE_IMAGE_WEBP_QUALITY = 80
+
+RECIPE_IMAGE_WORKERS = 2
+
+# Возраст в секундах, после которого неиспользуемый файл картинки
+# удаляет cleanup_recipe_images.
+RECIPE_IMAGE_ORPHAN_GRACE = 60 * 60 * 24
+
+# Бэкенд полнотекстового поиска рецептов: SQLite FTS5 или
+# api.search.PostgresSearchBackend для PostgreSQL.
+RECIPE_SEARCH_BACKEND = 'api.search.SQLiteSearchBackend'
+
+# Подбор рецептов по имеющимся ингредиентам (?have_ingredients=):
+# наибольшее число ингредиентов в запросе и рецептов в выдаче.
+HAVE_INGREDIENTS_MAX_IDS = 100
+
+HAVE_INGREDIENTS_LIMIT = 500
+
+# Админка: до скольких строк считать выдачу списка объектов.
+ADMIN_COUNT_LIMIT = 10000
+
+# Время кэширования клиентами списков тегов и ингредиентов, секунды.
+REFERENCE_DATA_MAX_AGE = 60 * 60 * 24
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -108,6 +252,27 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Первый хэшер основной: при входе пароли, захэшированные другими,
+# перехэшируются им. Для Argon2 нужен пакет argon2-cffi.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Пул хэширования паролей: число потоков, размер очереди
+# и Retry-After (с) для ответа 503 при переполнении.
+PASSWORD_HASHING_WORKERS = 2
+
+PASSWORD_HASHING_QUEUE_SIZE = 16
+
+PASSWORD_HASHING_RETRY_AFTER = 1
+
+# Асинхронные представления чтения рецептов, тегов и ингредиентов,
+# включаются в foodgram/asgi.py.
+ASYNC_READ_VIEWS = os.getenv('FOODGRAM_ASYNC_VIEWS', 'False') == 'True'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
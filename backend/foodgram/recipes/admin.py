@@ -1,16 +1,64 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.db.models import Exists, OuterRef
+
+from api.images import schedule_recipe_images
 from recipes.models import (
     Favorite, Ingredient, Recipe,
     RecipeIngredient, RecipeShoppingList,
     ShoppingList, Tag
 )
+from recipes.paginators import LimitedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''
+    Основа для админок больших таблиц: количество строк считается
+    с ограничением, без второго COUNT(*) по всей таблице при поиске.
+    '''
+    paginator = LimitedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        try:
+            page_number = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page_number = 1
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            page_number=page_number
+        )
+
+
+class TagListFilter(admin.SimpleListFilter):
+    '''
+    Фильтр рецептов по тегу через EXISTS: без JOIN и DISTINCT
+    по всему списку рецептов.
+    '''
+    title = 'Тэги'
+    parameter_name = 'tag'
+
+    def lookups(self, request, model_admin):
+        return Tag.objects.values_list('slug', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__slug=self.value()
+            )
+        ))
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     '''Поиск и отображение для модели "Избранное" в админке.'''
     search_fields = ('user__username',)
     list_display = ('__str__', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(Ingredient)
@@ -27,43 +75,57 @@ class RecipeIngredientInline(admin.TabularInline):
     '''
     model = RecipeIngredient
     extra = 1
+    autocomplete_fields = ('ingredient',)
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableAdmin):
     '''
     Поиск, дополнительные промежуточные модели, фильтры, и отображение
     для модели "Рецепты" в админке.
     '''
     inlines = [RecipeIngredientInline,]
-    list_display = ('name', 'author', 'get_favorite_count')
+    list_display = ('name', 'author', 'favorites_count')
+    list_select_related = ('author',)
     search_fields = ('name', 'author__username')
-    list_filter = ('tags', )
-
-    def get_favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
-
-    get_favorite_count.short_description = 'Вайки'
+    list_filter = (TagListFilter, )
+    autocomplete_fields = ('author',)
+    filter_horizontal = ('tags',)
+    readonly_fields = ('image_small', 'image_medium')
+
+    def save_model(self, request, obj, form, change):
+        # Новая картинка: старые копии сбрасываются, новые строятся
+        # в фоне, как при сохранении через API.
+        image_changed = 'image' in form.changed_data
+        if image_changed:
+            obj.image_small = obj.image_medium = ''
+        super().save_model(request, obj, form, change)
+        if image_changed:
+            schedule_recipe_images(obj.pk)
 
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(LargeTableAdmin):
     '''
     Поиск и отображение для промежуточной модели
     "Рецепты-ингредиенты" в админке.
     '''
     list_display = ('recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
     search_fields = ('recipe__name', 'ingredient__name')
+    autocomplete_fields = ('recipe', 'ingredient')
 
 
 @admin.register(RecipeShoppingList)
-class RecipeShoppingListAdmin(admin.ModelAdmin):
+class RecipeShoppingListAdmin(LargeTableAdmin):
     '''
     Поиск и отображение для промежуточной модели
     "Рецепты-список покупок" в админке.
     '''
     search_fields = ('shopping_list__owner__username',)
     list_display = ('__str__', 'shopping_list', 'recipe')
+    list_select_related = ('shopping_list__owner', 'recipe')
+    autocomplete_fields = ('shopping_list', 'recipe')
 
 
 class ShoppingListInline(admin.TabularInline):
@@ -73,16 +135,24 @@ class ShoppingListInline(admin.TabularInline):
     '''
     model = RecipeShoppingList
     extra = 1
+    autocomplete_fields = ('recipe',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'shopping_list__owner', 'recipe'
+        )
 
 
 @admin.register(ShoppingList)
-class ShoppingListAdmin(admin.ModelAdmin):
+class ShoppingListAdmin(LargeTableAdmin):
     '''
     Поиск и дополнительная промежуточная модель,
     для модели "Список покупок" в админке.
     '''
     inlines = [ShoppingListInline]
     search_fields = ('owner__username',)
+    list_select_related = ('owner',)
+    autocomplete_fields = ('owner',)
 
 
 @admin.register(Tag)
@@ -0,0 +1,72 @@
+import re
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe, recipe_image_storage
+
+FAN_OUT_DIR = re.compile(r'^[0-9a-f]{2}$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы картинок рецептов, на которые не ссылается '
+        'ни один рецепт. Свежие файлы не трогает: ссылка на них может '
+        'быть еще не записана.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=settings.RECIPE_IMAGE_ORPHAN_GRACE,
+            help='Возраст файла в секундах, после которого его можно удалить.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+
+    def leaf_directories(self, directory):
+        '''Каталоги второго уровня: <directory>/ab/cd.'''
+        storage = recipe_image_storage
+        if not storage.exists(directory):
+            return
+        for first in storage.listdir(directory)[0]:
+            if not FAN_OUT_DIR.match(first):
+                continue
+            for second in storage.listdir(f'{directory}{first}')[0]:
+                if FAN_OUT_DIR.match(second):
+                    yield f'{directory}{first}/{second}'
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        deadline = time.time() - options['grace']
+        directories = {
+            Recipe._meta.get_field(field).upload_to
+            for field in ('image', 'image_small', 'image_medium')
+        }
+        checked = removed = 0
+        for directory in sorted(directories):
+            for leaf in self.leaf_directories(directory):
+                names = [
+                    f'{leaf}/{file_name}'
+                    for file_name in storage.listdir(leaf)[1]
+                    if storage.is_hashed(f'{leaf}/{file_name}', directory)
+                ]
+                checked += len(names)
+                candidates = {
+                    name for name in names
+                    if storage.get_modified_time(name).timestamp() < deadline
+                }
+                if not candidates:
+                    continue
+                candidates -= Recipe.objects.referenced_images(candidates)
+                for name in sorted(candidates):
+                    self.stdout.write(name)
+                    if not options['dry_run']:
+                        storage.delete(name)
+                removed += len(candidates)
+        action = 'Найдено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}. {action} лишних: {removed}.'
+        ))
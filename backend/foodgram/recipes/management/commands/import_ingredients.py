@@ -0,0 +1,132 @@
+import codecs
+import csv
+import json
+import time
+from pathlib import Path
+
+import chardet
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.indexes import IngredientIndex
+from api.versions import bump_versions, INGREDIENTS_SCOPE
+from recipes.models import Ingredient
+
+# Объем начала файла, по которому определяется кодировка.
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def detect_encoding(path: Path) -> str:
+    '''Определяет кодировку файла по его началу.'''
+    with open(path, 'rb') as file:
+        sample = file.read(ENCODING_SAMPLE_SIZE)
+    try:
+        # Символ, обрезанный на границе сэмпла, не считается ошибкой.
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return chardet.detect(sample)['encoding'] or 'utf-8'
+    return 'utf-8-sig'
+
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        yield row['name'], row['measurement_unit']
+
+
+def read_json(file):
+    '''Построчно читает JSON-массив объектов, не загружая файл целиком.'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('Ожидается JSON-массив.')
+                buffer = buffer[1:]
+                started = True
+                continue
+            buffer = buffer.lstrip(', \t\r\n')
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            buffer = buffer[end:]
+            yield item['name'], item['measurement_unit']
+        if not chunk:
+            if buffer.strip():
+                raise CommandError('Файл обрывается посреди JSON-массива.')
+            return
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON пакетами, '
+        'пропуская повторы и уже существующие пары (название, единица).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='data/ingredients.csv',
+            help='Путь до файла с ингредиентами.'
+        )
+        parser.add_argument(
+            '--format', choices=READERS, default=None,
+            help='Формат файла, по умолчанию по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Размер пакета вставки.'
+        )
+
+    def insert(self, batch):
+        '''
+        Вставляет пакет ингредиентов. Дубли в пакете и уже
+        существующие в БД пары отбрасывает ограничение unique_ingredient.
+        '''
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}.')
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+        count_before = Ingredient.objects.count()
+        total = 0
+        batch = []
+        encoding = detect_encoding(path)
+        with open(path, encoding=encoding, newline='') as file, \
+                transaction.atomic():
+            for name, unit in READERS[file_format](file):
+                total += 1
+                batch.append(Ingredient(
+                    name=name.strip(), measurement_unit=unit.strip()
+                ))
+                if len(batch) >= batch_size:
+                    self.insert(batch)
+                    batch = []
+            self.insert(batch)
+        created = Ingredient.objects.count() - count_before
+        IngredientIndex.invalidate(created=True)
+        bump_versions(INGREDIENTS_SCOPE)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено: {created}, '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-9):.0f} строк/с).'
+        ))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from api.response_cache import invalidate_recipe_responses
+from recipes.models import Recipe, recipe_image_storage
+
+IMAGE_FIELDS = ('image', 'image_small', 'image_medium')
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки рецептов в хранилище по хэшу содержимого: '
+        'одинаковые файлы сливаются в один, старые файлы удаляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько рецептов читать из БД за раз.'
+        )
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Не удалять файлы со старыми именами.'
+        )
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        moved = missing = 0
+        old_names = set()
+        recipes = Recipe.objects.only(*IMAGE_FIELDS).order_by('pk')
+        for recipe in recipes.iterator(chunk_size=options['batch_size']):
+            fields = {}
+            for field_name in IMAGE_FIELDS:
+                image = getattr(recipe, field_name)
+                directory = Recipe._meta.get_field(field_name).upload_to
+                if not image or storage.is_hashed(image.name, directory):
+                    continue
+                try:
+                    with storage.open(image.name, 'rb') as content:
+                        fields[field_name] = storage.save(image.name, content)
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(
+                        f'Рецепт {recipe.pk}: нет файла {image.name}.'
+                    )
+                    continue
+                old_names.add(image.name)
+            if fields:
+                Recipe.objects.filter(pk=recipe.pk).update(**fields)
+                invalidate_recipe_responses(recipe.pk)
+                moved += 1
+        deleted = 0
+        if not options['keep_old']:
+            old_names -= Recipe.objects.referenced_images(old_names)
+            for name in old_names:
+                storage.delete(name)
+            deleted = len(old_names)
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено рецептов: {moved}, удалено старых файлов: '
+            f'{deleted}, не найдено файлов: {missing}.'
+        ))
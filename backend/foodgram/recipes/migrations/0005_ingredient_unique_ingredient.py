@@ -0,0 +1,57 @@
+# Generated by Django 3.2.16 on 2026-10-17 01:41
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+# Предел PositiveSmallIntegerField на всех поддерживаемых БД.
+MAX_AMOUNT = 32767
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    '''
+    Склеивает дубли ингредиентов перед добавлением уникальности:
+    рецепты переводятся на ингредиент с наименьшим id. Если в рецепте
+    есть несколько дублей, они сливаются в одну строку с суммой amount.
+    '''
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = Ingredient.objects.order_by().values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        group = list(Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit']
+        ).values_list('pk', flat=True))
+        links = RecipeIngredient.objects.filter(ingredient__in=group)
+        merged = links.order_by().values('recipe').annotate(
+            keep_id=Min('id'), total_amount=Sum('amount'), rows=Count('id')
+        ).filter(rows__gt=1)
+        for recipe in merged:
+            RecipeIngredient.objects.filter(pk=recipe['keep_id']).update(
+                amount=min(recipe['total_amount'], MAX_AMOUNT)
+            )
+            links.filter(recipe=recipe['recipe']).exclude(
+                pk=recipe['keep_id']
+            ).delete()
+        links.update(ingredient_id=duplicate['keep_id'])
+        Ingredient.objects.filter(pk__in=group).exclude(
+            pk=duplicate['keep_id']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_alter_recipe_cooking_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-17 01:57
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(max_length=255, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/images/', verbose_name='Изображение'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image_medium',
+            field=models.ImageField(blank=True, editable=False, max_length=255, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/images/medium/', verbose_name='Средняя копия изображения'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image_small',
+            field=models.ImageField(blank=True, editable=False, max_length=255, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/images/small/', verbose_name='Маленькая копия изображения'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.16 on 2026-10-17 02:05
+
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    '''
+    Таблица полнотекстового поиска SQLite FTS5 (rowid - id рецепта),
+    заполняется fill_search_table, затем сигналами Recipe и командой
+    rebuild_search_index. На других СУБД не нужна.
+    '''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_search "
+        "USING fts5(name, text, tokenize='unicode61 remove_diacritics 2', "
+        "prefix='2 3')"
+    )
+
+
+def fill_search_table(apps, schema_editor):
+    '''
+    Индексирует уже существующие рецепты теми же основами слов,
+    что и SQLiteSearchBackend: иначе поиск не находит их до запуска
+    rebuild_search_index.
+    '''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from api.search import SQLiteSearchBackend
+
+    Recipe = apps.get_model('recipes', 'Recipe')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        SQLiteSearchBackend().fill(
+            cursor, Recipe.objects.using(connection.alias)
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+        migrations.RunPython(fill_search_table, migrations.RunPython.noop),
+    ]
@@ -2,12 +2,17 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import (
+    BooleanField, Exists, OuterRef, Prefetch, UniqueConstraint, Value
+)
 
+from recipes.storage import ContentAddressedStorage
 from recipes.validators import HexValidator
 
 User = get_user_model()
 
+recipe_image_storage = ContentAddressedStorage()
+
 
 class Tag(models.Model):
     '''Модель тэгов.'''
@@ -52,11 +57,70 @@ class Ingredient(models.Model):
         ordering = ('-id',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    '''QuerySet рецептов с аннотациями и подгрузкой связанных объектов.'''
+    def with_user_flags(self, user) -> 'RecipeQuerySet':
+        '''
+        Аннотирует флаги is_favorited и is_in_shopping_cart
+        для текущего пользователя.
+        '''
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                RecipeShoppingList.objects.filter(
+                    shopping_list__owner=user, recipe=OuterRef('pk')
+                )
+            )
+        )
+
+    def with_related(self, user) -> 'RecipeQuerySet':
+        '''
+        Подгружает автора, тэги и ингредиенты рецептов
+        фиксированным числом запросов.
+        '''
+        return self.prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_followed(user)
+            ),
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def referenced_images(self, names) -> set:
+        '''Имена файлов из names, на которые ссылаются рецепты.'''
+        names = list(names)
+        referenced = set()
+        for field in ('image', 'image_small', 'image_medium'):
+            referenced.update(
+                self.filter(**{f'{field}__in': names}).values_list(
+                    field, flat=True
+                )
+            )
+        return referenced
+
+
 class Recipe(models.Model):
     '''Модель рецептов.'''
     name = models.CharField(
@@ -65,7 +129,25 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         verbose_name='Изображение',
-        upload_to='recipes/images/'
+        upload_to='recipes/images/',
+        storage=recipe_image_storage,
+        max_length=255
+    )
+    image_small = models.ImageField(
+        verbose_name='Маленькая копия изображения',
+        upload_to='recipes/images/small/',
+        storage=recipe_image_storage,
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+    image_medium = models.ImageField(
+        verbose_name='Средняя копия изображения',
+        upload_to='recipes/images/medium/',
+        storage=recipe_image_storage,
+        max_length=255,
+        blank=True,
+        editable=False
     )
     text = models.TextField(verbose_name='Описание')
     cooking_time = models.PositiveSmallIntegerField(
@@ -92,11 +174,33 @@ class Recipe(models.Model):
         verbose_name='Время публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -123,6 +227,12 @@ class RecipeIngredient(models.Model):
         ordering = ('-id',)
         verbose_name = 'Таблица рецептов и ингредиентов'
         verbose_name_plural = 'Таблица рецептов и ингредиентов'
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                name='recipe_ingredient_idx'
+            ),
+        ]
 
 
 class Favorite(models.Model):
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    '''
+    Оценка числа строк таблицы по статистике PostgreSQL,
+    None для других СУБД и для таблиц без статистики.
+    '''
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            (queryset.model._meta.db_table,)
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class AtLeastCount(int):
+    '''Нижняя граница числа строк, выводится как «10000+».'''
+    def __str__(self):
+        return f'{int(self)}+'
+
+
+class LimitedCountPaginator(Paginator):
+    '''
+    Пагинатор админки без COUNT(*) по всей таблице: строки считаются
+    не дальше ADMIN_COUNT_LIMIT или следующей за запрошенной страницы.
+    Если их больше и список не отфильтрован, берется оценка
+    из статистики СУБД. Иначе число выдается как нижняя граница:
+    открытая страница и ссылка на следующую остаются доступны.
+    '''
+    def __init__(self, *args, page_number: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_number = page_number
+
+    @cached_property
+    def count(self) -> int:
+        limit = max(
+            settings.ADMIN_COUNT_LIMIT,
+            (self.page_number + 1) * self.per_page + 1
+        )
+        count = self.object_list[:limit].count()
+        if count < limit:
+            return count
+        if not self.object_list.query.has_filters():
+            estimate = estimate_count(self.object_list)
+            if estimate is not None:
+                return max(count, estimate)
+        return AtLeastCount(count)
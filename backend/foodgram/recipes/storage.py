@@ -0,0 +1,67 @@
+import hashlib
+import os
+import re
+from pathlib import PurePosixPath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    Хранилище, в котором имя файла - SHA-256 содержимого,
+    разложенный по двум уровням каталогов: <каталог>/ab/cd/abcd...ext.
+    Одинаковые файлы хранятся один раз и разделяются ссылками,
+    поэтому файлы не удаляются вместе с объектами: неиспользуемые
+    убирает команда cleanup_recipe_images.
+    '''
+    def hashed_name(self, name: str, digest: str) -> str:
+        path = PurePosixPath(name)
+        return str(
+            path.parent / digest[:2] / digest[2:4]
+            / f'{digest}{path.suffix.lower()}'
+        )
+
+    @staticmethod
+    def content_hash(content) -> str:
+        sha256 = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def is_hashed(name: str, directory: str) -> bool:
+        '''Имя файла уже в формате хранилища внутри directory.'''
+        path = PurePosixPath(name)
+        try:
+            relative = path.relative_to(directory)
+        except ValueError:
+            return False
+        return bool(HASH_NAME.match(str(relative)))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(
+            self.generate_filename(name), self.content_hash(content)
+        )
+        if self.exists(name):
+            # Свежее время изменения защищает файл от удаления
+            # cleanup_recipe_images, пока ссылка на него не записана.
+            os.utime(self.path(name))
+            return name
+        saved = self._save(name, content)
+        if saved != name:
+            # Такой же файл записан параллельно: копия не нужна.
+            self.delete(saved)
+        return name
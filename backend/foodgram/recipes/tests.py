@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient,
+    RecipeShoppingList, ShoppingList, Tag
+)
+from recipes.paginators import AtLeastCount, LimitedCountPaginator
+
+User = get_user_model()
+
+# Общие кэши (файлы, memcached) в тестах заменяются памятью процесса.
+TEST_CACHES = {
+    name: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': name,
+    }
+    for name in settings.CACHES
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdminQueryCountTests(TestCase):
+    '''Число запросов страниц админки не зависит от числа строк.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@foodgram.ru', password='admin',
+            first_name='Админ', last_name='Админов'
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'Тэг {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {i}', measurement_unit='г'
+            )
+            for i in range(10)
+        ]
+        for i in range(10):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {i}', text='Текст', cooking_time=5,
+                author=cls.admin, image=f'recipes/images/{i}.png'
+            )
+            recipe.tags.set(tags[:i % 3 + 1])
+            for ingredient in ingredients[i % 5:i % 5 + 3]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+            Favorite.objects.create(user=cls.admin, recipe=recipe)
+            RecipeShoppingList.objects.create(
+                shopping_list=ShoppingList.objects.get_or_create(
+                    owner=cls.admin
+                )[0],
+                recipe=recipe
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_page_queries(self, num, url, data=None):
+        with self.assertNumQueries(num):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changelists(self):
+        for model, num in (
+            (Recipe, 5),
+            (RecipeIngredient, 4),
+            (Favorite, 4),
+            (RecipeShoppingList, 4),
+            (ShoppingList, 4),
+        ):
+            with self.subTest(model=model.__name__):
+                self.assert_page_queries(num, reverse(
+                    f'admin:recipes_{model._meta.model_name}_changelist'
+                ))
+
+    def test_recipe_changelist_filtered(self):
+        self.assert_page_queries(
+            5, reverse('admin:recipes_recipe_changelist'),
+            {'tag': 'tag0', 'q': 'Рецепт'}
+        )
+
+    def test_autocomplete(self):
+        self.assert_page_queries(4, reverse('admin:autocomplete'), {
+            'term': 'Продукт', 'app_label': 'recipes',
+            'model_name': 'recipeingredient', 'field_name': 'ingredient'
+        })
+
+
+class LimitedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Продукт {i}', measurement_unit='г')
+            for i in range(10)
+        )
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_count_beyond_limit_keeps_next_page(self):
+        paginator = LimitedCountPaginator(
+            Ingredient.objects.all(), 2, page_number=3
+        )
+        self.assertIsInstance(paginator.count, AtLeastCount)
+        self.assertEqual(str(paginator.count), '9+')
+        self.assertTrue(paginator.page(3).has_next())
+        self.assertTrue(paginator.page(4).has_other_pages())
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_exact_count_near_the_end(self):
+        paginator = LimitedCountPaginator(
+            Ingredient.objects.all(), 2, page_number=5
+        )
+        self.assertEqual(paginator.count, 10)
+        self.assertNotIsInstance(paginator.count, AtLeastCount)
+        self.assertFalse(paginator.page(5).has_next())
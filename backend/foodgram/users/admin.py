@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from recipes.admin import LargeTableAdmin
 from users.models import CustomUser, Subscription
 
 
@@ -8,10 +9,16 @@ class SubscriptionInline(admin.TabularInline):
     model = Subscription
     fk_name = 'subscriber'
     extra = 1
+    autocomplete_fields = ('subscribed_to',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'subscriber', 'subscribed_to'
+        )
 
 
 @admin.register(CustomUser)
-class CustomUserAdmin(admin.ModelAdmin):
+class CustomUserAdmin(LargeTableAdmin):
     '''
     Поиск, добавление промежуточной таблицы и отображение,
     для модели "Пользователи" в админке
@@ -27,12 +34,17 @@ class CustomUserAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('email',)
     inlines = [SubscriptionInline]
-    list_display = ('username', 'email', 'first_name', 'last_name')
+    list_display = (
+        'username', 'email', 'first_name', 'last_name',
+        'recipes_count', 'subscribers_count'
+    )
     search_fields = ('username', 'email')
 
 
 @admin.register(Subscription)
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(LargeTableAdmin):
     '''Поиск и отображение для модели "Подписки" в админке'''
     list_display = ('__str__', 'subscriber', 'subscribed_to')
+    list_select_related = ('subscriber', 'subscribed_to')
+    autocomplete_fields = ('subscriber', 'subscribed_to')
     search_fields = ('subscriber__username', 'subscribed_to__username')
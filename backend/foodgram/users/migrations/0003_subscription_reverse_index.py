@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_customuser_managers'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['subscribed_to', 'subscriber'], name='subscription_reverse_idx'),
+        ),
+    ]
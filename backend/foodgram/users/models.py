@@ -1,9 +1,12 @@
 from django.conf import settings
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.validators import MinLengthValidator
-from django.db import models
-from django.db.models import CheckConstraint, F, UniqueConstraint, Q
+from django.db import models, transaction
+from django.db.models import (
+    BooleanField, CheckConstraint, Exists, F, OuterRef, Q, UniqueConstraint,
+    Value
+)
 
 from users.validators import username_validator
 
@@ -44,11 +47,38 @@ class Subscription(models.Model):
                 name='prevent_duplicate_subscription'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['subscribed_to', 'subscriber'],
+                name='subscription_reverse_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'"{self.subscriber}", подписался на "{self.subscribed_to}"'
 
 
+class CustomUserQuerySet(models.QuerySet):
+    '''QuerySet пользователей с аннотациями для текущего пользователя.'''
+    def with_is_followed(self, user) -> 'CustomUserQuerySet':
+        '''Аннотирует флаг is_followed: подписан ли user на пользователя.'''
+        if not user.is_authenticated:
+            return self.annotate(
+                is_followed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_followed=Exists(
+                Subscription.objects.filter(
+                    subscriber=user, subscribed_to=OuterRef('pk')
+                )
+            )
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(CustomUserQuerySet)):
+    '''Менеджер пользователей с методами CustomUserQuerySet.'''
+
+
 class CustomUser(AbstractUser):
     '''Кастомная модель пользователя.'''
     email = models.EmailField(
@@ -83,10 +113,23 @@ class CustomUser(AbstractUser):
         related_name='following',
         verbose_name='Подписки'
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
+
+    objects = CustomUserManager()
 
     def subscribe(self, user: 'CustomUser') -> None:
-        '''Подписка.'''
-        Subscription.objects.create(subscriber=self, subscribed_to=user)
+        '''Подписка, в одной транзакции со счетчиком подписчиков.'''
+        with transaction.atomic():
+            Subscription.objects.create(subscriber=self, subscribed_to=user)
 
     def unsubscribe(self, user: 'CustomUser') -> None:
         '''Отписка.'''
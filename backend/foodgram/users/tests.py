@@ -0,0 +1,50 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from recipes.tests import TEST_CACHES
+from users.models import CustomUser, Subscription
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AdminQueryCountTests(TestCase):
+    '''Число запросов страниц админки не зависит от числа строк.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@foodgram.ru', password='admin',
+            first_name='Админ', last_name='Админов'
+        )
+        for i in range(10):
+            user = CustomUser.objects.create_user(
+                username=f'user{i}', email=f'user{i}@foodgram.ru',
+                password='password', first_name='Имя', last_name='Фамилия'
+            )
+            Subscription.objects.create(
+                subscriber=user, subscribed_to=cls.admin
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assert_page_queries(self, num, url, data=None):
+        with self.assertNumQueries(num):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changelists(self):
+        for model, num in ((CustomUser, 4), (Subscription, 4)):
+            with self.subTest(model=model.__name__):
+                self.assert_page_queries(num, reverse(
+                    f'admin:users_{model._meta.model_name}_changelist'
+                ))
+
+    def test_user_changelist_search(self):
+        self.assert_page_queries(
+            4, reverse('admin:users_customuser_changelist'), {'q': 'user'}
+        )
+
+    def test_autocomplete(self):
+        self.assert_page_queries(4, reverse('admin:autocomplete'), {
+            'term': 'user', 'app_label': 'users',
+            'model_name': 'subscription', 'field_name': 'subscribed_to'
+        })